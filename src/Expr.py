@@ -125,3 +125,27 @@ class Assignment(Expr):
         return visitor.visitAssignmentExpr(self)
 
 
+class Invoke(Expr):
+
+    def __init__(self, obj, name, paren, arguments):
+        self.obj = obj
+        self.name = name
+        self.paren = paren
+        self.arguments = arguments
+
+    def accept(self,visitor):
+        return visitor.visitInvokeExpr(self)
+
+
+class SuperInvoke(Expr):
+
+    def __init__(self, keyword, method, paren, arguments):
+        self.keyword = keyword
+        self.method = method
+        self.paren = paren
+        self.arguments = arguments
+
+    def accept(self,visitor):
+        return visitor.visitSuperInvokeExpr(self)
+
+
@@ -50,3 +50,11 @@ class ExprVisitor(ABC):
     def visitAssignmentExpr(self, expr):
         pass
 
+    @abstractmethod
+    def visitInvokeExpr(self, expr):
+        pass
+
+    @abstractmethod
+    def visitSuperInvokeExpr(self, expr):
+        pass
+
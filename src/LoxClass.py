@@ -6,29 +6,31 @@ class LoxClass(LoxCallable):
     def __init__(self, name, superclass, methods):
         self.name = name
         self.superclass = superclass
-        self.methods = methods
+        # Inherited methods are copied down when the class is created, so a
+        # lookup is one probe however deep the hierarchy is.
+        self.methods = {}
+        if superclass is not None:
+            self.methods.update(superclass.methods)
+        self.methods.update(methods)
+        # Methods can't change once the class exists, so every call of the
+        # class can reuse the initializer and its arity.
+        self.initializer = self.methods.get("init")
+        if self.initializer is None:
+            self.initializerArity = 0
+        else:
+            self.initializerArity = self.initializer.arity()
 
     def findMethod(self, name):
-        if name in self.methods:
-            return self.methods[name]
-
-        if self.superclass is not None:
-            return self.superclass.findMethod(name)
-
-        return None
+        return self.methods.get(name)
 
     def call(self, interpreter, arguments):
         instance = LoxInstance(self)
-        initializer = self.findMethod("init")
-        if initializer is not None:
-            initializer.bind(instance).call(interpreter, arguments)
+        if self.initializer is not None:
+            self.initializer.call(interpreter, arguments, instance)
         return instance
 
     def arity(self):
-        initializer = self.findMethod("init")
-        if initializer is None:
-            return 0
-        return initializer.arity()
+        return self.initializerArity
 
     def __str__(self):
         return self.name
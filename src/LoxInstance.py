@@ -1,11 +1,38 @@
+class Shape:
+    # Field layout shared by every instance that got the same fields in the
+    # same order. Adding a field moves an instance on to the child shape for
+    # it, so instances only store their values.
+    __slots__ = ("indexes", "transitions")
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.transitions = {}
+
+    def withField(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            indexes = dict(self.indexes)
+            indexes[name] = len(indexes)
+            shape = Shape(indexes)
+            self.transitions[name] = shape
+        return shape
+
+
+EMPTY_SHAPE = Shape({})
+
+
 class LoxInstance:
+    __slots__ = ("klass", "shape", "values")
+
     def __init__(self, klass):
         self.klass = klass
-        self.fields = {}
+        self.shape = EMPTY_SHAPE
+        self.values = []
 
     def get(self, name):
-        if name.lexeme in self.fields:
-            return self.fields[name.lexeme]
+        index = self.shape.indexes.get(name.lexeme)
+        if index is not None:
+            return self.values[index]
 
         method = self.klass.findMethod(name.lexeme)
         if method is not None:
@@ -14,7 +41,12 @@ class LoxInstance:
         raise RuntimeError(name, f"Undefined property '{name.lexeme}'.")
 
     def set(self, name, value):
-        self.fields[name.lexeme] = value
+        index = self.shape.indexes.get(name.lexeme)
+        if index is None:
+            self.shape = self.shape.withField(name.lexeme)
+            self.values.append(value)
+        else:
+            self.values[index] = value
 
     def __str__(self):
         return f"{self.klass.name} instance"
@@ -1,3 +1,6 @@
-class ReturnValue(RuntimeError):
-    def __init__(self, value):
-        self.value = value
+# Statements complete with None, except `return`, which leaves its value in
+# Interpreter.returnValue and completes with RETURN. Enclosing statements
+# stop as soon as they see it and the call picks the value up. A call in
+# tail position leaves Interpreter.tailCall instead, for the caller's
+# LoxFunction.call to run in place of the current one.
+RETURN = object()
@@ -0,0 +1,85 @@
+from array import array
+from enum import IntEnum
+from enum import auto
+
+
+class OpCode(IntEnum):
+    CONSTANT = auto()
+    NIL = auto()
+    TRUE = auto()
+    FALSE = auto()
+    POP = auto()
+    GET_LOCAL = auto()
+    SET_LOCAL = auto()
+    GET_GLOBAL = auto()
+    DEFINE_GLOBAL = auto()
+    SET_GLOBAL = auto()
+    GET_UPVALUE = auto()
+    SET_UPVALUE = auto()
+    GET_PROPERTY = auto()
+    SET_PROPERTY = auto()
+    GET_SUPER = auto()
+    CHECK_PROPERTY = auto()
+    CHECK_SUPER = auto()
+    EQUAL = auto()
+    NOT_EQUAL = auto()
+    GREATER = auto()
+    GREATER_EQUAL = auto()
+    LESS = auto()
+    LESS_EQUAL = auto()
+    ADD = auto()
+    SUBTRACT = auto()
+    MULTIPLY = auto()
+    DIVIDE = auto()
+    NOT = auto()
+    NEGATE = auto()
+    PRINT = auto()
+    JUMP = auto()
+    JUMP_IF_FALSE = auto()
+    LOOP = auto()
+    CALL = auto()
+    INVOKE = auto()
+    SUPER_INVOKE = auto()
+    CLOSURE = auto()
+    CLOSE_UPVALUE = auto()
+    RETURN = auto()
+    CLASS = auto()
+    INHERIT = auto()
+    METHOD = auto()
+
+
+class Chunk:
+    # Code is a flat array of 16 bit words: an opcode is followed by its
+    # operands, and lines holds the source line of every word.
+    def __init__(self):
+        self.code = array("H")
+        self.lines = array("I")
+        self.constants = []
+        self.constantIndex = {}
+
+    def write(self, word, line):
+        self.code.append(word)
+        self.lines.append(line)
+
+    def addConstant(self, value):
+        key = (type(value), value)
+        if key in self.constantIndex:
+            return self.constantIndex[key]
+
+        self.constants.append(value)
+        index = len(self.constants) - 1
+        self.constantIndex[key] = index
+        return index
+
+
+class FunctionProto:
+    def __init__(self, name):
+        self.name = name
+        self.arity = 0
+        self.upvalueCount = 0
+        self.chunk = Chunk()
+
+    def __str__(self):
+        if self.name is None:
+            return "<script>"
+        return f"<fn {self.name}>"
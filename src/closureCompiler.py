@@ -0,0 +1,861 @@
+from ExprVisitor import ExprVisitor
+from StmtVisitor import StmtVisitor
+from environment import Environment
+from environment import Cell
+from environment import UPVALUE
+from environment import GLOBAL
+from loxFunction import LoxFunction
+from LoxClass import LoxClass
+from LoxInstance import LoxInstance
+from Return import RETURN
+from Expr import Invoke
+from Expr import SuperInvoke
+from Expr import Literal
+from token import TokenType
+from loxNumber import NUMBER_TYPES
+from loxNumber import MAX_EXACT
+from loxNumber import divide
+from rope import STRING_TYPES
+from rope import concatenate
+from loxValue import stringify
+
+
+class CompiledFunction(LoxFunction):
+    def __init__(
+        self, declaration, body, cells, upvalues, isInitializer, instance=None
+    ):
+        super().__init__(declaration, upvalues, isInitializer, instance)
+        self.body = body
+        self.cells = cells
+
+    def execute(self, interpreter, environment):
+        values = environment.values
+        for index in self.cells:
+            values[index] = Cell(values[index])
+        return self.body(environment)
+
+    def bind(self, instance):
+        return CompiledFunction(
+            self.declaration,
+            self.body,
+            self.cells,
+            self.upvalues,
+            self.isInitializer,
+            instance,
+        )
+
+
+class ClosureCompiler(ExprVisitor, StmtVisitor):
+    # Turns a resolved AST into nested Python closures. Every closure takes
+    # the current Environment and has its operator, resolved depth and
+    # children bound when it is created, so running the program does no
+    # visitor dispatch and no operator matching.
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.globals = interpreter.globals
+
+    def run(self, statements):
+        try:
+            program = self.compile(statements)
+            program(self.globals)
+        except RuntimeError as error:
+            self.interpreter.errorHandler.runtimeError(error)
+
+    def compile(self, statements):
+        compiled = tuple(statement.accept(self) for statement in statements)
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def sequence(env):
+            for statement in compiled:
+                if statement(env) is RETURN:
+                    return RETURN
+
+        return sequence
+
+    def compileGlobal(self, name):
+        globals = self.globals
+        cell = None
+
+        def getGlobal(env):
+            nonlocal cell
+            if cell is None:
+                cell = globals.cell(name)
+            return cell.value
+
+        return getGlobal
+
+    def compileLocal(self, distance, index):
+        if distance == GLOBAL:
+
+            def getLocal(env):
+                return index
+
+        elif distance == UPVALUE:
+
+            def getLocal(env):
+                return env.upvalues[index]
+
+        elif distance == 0:
+
+            def getLocal(env):
+                return env.values[index]
+
+        elif distance == 1:
+
+            def getLocal(env):
+                return env.enclosing.values[index]
+
+        else:
+
+            def getLocal(env):
+                return env.getAt(distance, index)
+
+        return getLocal
+
+    def compileLookUp(self, name, expr):
+        slot = getattr(expr, "resolved", None)
+        if slot is None:
+            return self.compileGlobal(name)
+
+        distance, index, boxed = slot
+        getLocal = self.compileLocal(distance, index)
+        if not boxed:
+            return getLocal
+
+        def getCell(env):
+            return getLocal(env).value
+
+        return getCell
+
+    def compileFunction(self, declaration, isInitializer):
+        body = self.compile(declaration.body)
+        cells = declaration.cells
+        capture = self.interpreter.capture
+
+        def function(env):
+            return CompiledFunction(
+                declaration, body, cells, capture(declaration, env), isInitializer
+            )
+
+        return function
+
+    def visitExpressionStmt(self, stmt):
+        return stmt.expression.accept(self)
+
+    def visitFunctionStmt(self, stmt):
+        function = self.compileFunction(stmt, False)
+        name = stmt.name.lexeme
+
+        if stmt.name.boxed:
+
+            def functionStmt(env):
+                cell = Cell()
+                env.define(name, cell)
+                cell.value = function(env)
+
+        else:
+
+            def functionStmt(env):
+                env.define(name, function(env))
+
+        return functionStmt
+
+    def visitPrintStmt(self, stmt):
+        expression = stmt.expression.accept(self)
+
+        def printStmt(env):
+            print(stringify(expression(env)))
+
+        return printStmt
+
+    def visitReturnStmt(self, stmt):
+        interpreter = self.interpreter
+        if stmt.isTailCall:
+            return self.compileTailCall(stmt.value)
+
+        if stmt.value is None:
+
+            def returnStmt(env):
+                interpreter.returnValue = None
+                return RETURN
+
+        else:
+            value = stmt.value.accept(self)
+
+            def returnStmt(env):
+                interpreter.returnValue = value(env)
+                return RETURN
+
+        return returnStmt
+
+    def compileTailCall(self, expr):
+        interpreter = self.interpreter
+        if isinstance(expr, Invoke):
+            target = self.compileInvokeTarget(expr)
+        elif isinstance(expr, SuperInvoke):
+            target = self.compileSuperInvokeTarget(expr)
+        else:
+            callee = expr.callee.accept(self)
+            arguments = tuple(argument.accept(self) for argument in expr.arguments)
+            paren = expr.paren
+            checkCall = interpreter.checkCall
+
+            def target(env):
+                function = callee(env)
+                values = [argument(env) for argument in arguments]
+                checkCall(function, values, paren)
+                return function, None, values
+
+        def tailCall(env):
+            function, instance, values = target(env)
+            if isinstance(function, LoxFunction):
+                if instance is None:
+                    instance = function.instance
+                interpreter.tailCall = (function, instance, values)
+            else:
+                interpreter.returnValue = function.call(interpreter, values)
+            return RETURN
+
+        return tailCall
+
+    def visitVarStmt(self, stmt):
+        name = stmt.name.lexeme
+        if stmt.initializer is None:
+
+            def initializer(env):
+                return None
+
+        else:
+            initializer = stmt.initializer.accept(self)
+
+        if stmt.name.boxed:
+
+            def var(env):
+                env.define(name, Cell(initializer(env)))
+
+        elif stmt.initializer is None:
+
+            def var(env):
+                env.define(name, None)
+
+        else:
+
+            def var(env):
+                env.define(name, initializer(env))
+
+        return var
+
+    def visitWhileStmt(self, stmt):
+        condition = stmt.condition.accept(self)
+        body = stmt.body.accept(self)
+
+        def whileStmt(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return None
+                if body(env) is RETURN:
+                    return RETURN
+
+        return whileStmt
+
+    def visitBlockStmt(self, stmt):
+        body = self.compile(stmt.statements)
+        if stmt.isEmpty:
+            return body
+
+        def block(env):
+            return body(Environment(env))
+
+        return block
+
+    def visitClassStmt(self, stmt):
+        name = stmt.name
+        superclassExpr = None
+        if stmt.superclass is not None:
+            superclassExpr = stmt.superclass.accept(self)
+        methods = [
+            (
+                method.name.lexeme,
+                self.compileFunction(method, method.name.lexeme == "init"),
+            )
+            for method in stmt.methods
+        ]
+        boxed = name.boxed
+
+        def classStmt(env):
+            superclass = None
+            if superclassExpr is not None:
+                superclass = superclassExpr(env)
+                if not isinstance(superclass, LoxClass):
+                    raise RuntimeError(
+                        stmt.superclass.name, "Superclass must be a class."
+                    )
+
+            cell = None
+            if boxed:
+                cell = Cell()
+                env.define(name.lexeme, cell)
+
+            methodEnv = env
+            if superclassExpr is not None:
+                methodEnv = Environment(env)
+                methodEnv.define("super", superclass)
+
+            functions = {}
+            for methodName, method in methods:
+                functions[methodName] = method(methodEnv)
+
+            klass = LoxClass(name.lexeme, superclass, functions)
+            if cell is not None:
+                cell.value = klass
+            else:
+                env.define(name.lexeme, klass)
+
+        return classStmt
+
+    def visitIfStmt(self, stmt):
+        condition = stmt.condition.accept(self)
+        thenBranch = stmt.thenBranch.accept(self)
+        if stmt.elseBranch is None:
+
+            def ifStmt(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return thenBranch(env)
+                return None
+
+        else:
+            elseBranch = stmt.elseBranch.accept(self)
+
+            def ifStmt(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return thenBranch(env)
+                return elseBranch(env)
+
+        return ifStmt
+
+    def visitBinaryExpr(self, expr):
+        left = expr.left.accept(self)
+        operator = expr.operator
+        if isinstance(expr.right, Literal) and type(expr.right.value) is int:
+            binary = self.compileIntegerOperand(left, operator, expr.right.value)
+            if binary is not None:
+                return binary
+
+        right = expr.right.accept(self)
+
+        match operator.type:
+            case TokenType.PLUS:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) is int and type(b) is int:
+                        result = a + b
+                        if -MAX_EXACT <= result <= MAX_EXACT:
+                            return result
+                        return float(result)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return a + b
+                    if type(a) in STRING_TYPES and type(b) in STRING_TYPES:
+                        return concatenate(a, b)
+                    raise RuntimeError(
+                        operator, "Operands must be two numbers or two strings."
+                    )
+
+            case TokenType.MINUS:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) is int and type(b) is int:
+                        result = a - b
+                        if -MAX_EXACT <= result <= MAX_EXACT:
+                            return result
+                        return float(result)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return a - b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.SLASH:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return divide(a, b)
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.STAR:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) is int and type(b) is int:
+                        result = a * b
+                        if -MAX_EXACT <= result <= MAX_EXACT:
+                            return result
+                        return float(result)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return a * b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.GREATER:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return a > b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.GREATER_EQUAL:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return a >= b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.LESS:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return a < b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.LESS_EQUAL:
+
+                def binary(env):
+                    a = left(env)
+                    b = right(env)
+                    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+                        return a <= b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.BANG_EQUAL:
+                isEqual = self.interpreter.isEqual
+
+                def binary(env):
+                    return not isEqual(left(env), right(env))
+
+            case TokenType.EQUAL_EQUAL:
+                isEqual = self.interpreter.isEqual
+
+                def binary(env):
+                    return isEqual(left(env), right(env))
+
+            case _:
+
+                def binary(env):
+                    left(env)
+                    right(env)
+                    return None
+
+        return binary
+
+    def compileIntegerOperand(self, left, operator, b):
+        # Counters and indexes are mostly updated and compared with integer
+        # literals, which needs one type check and, for an integral result,
+        # only the bound it can move towards.
+        match operator.type:
+            case TokenType.PLUS if b >= 0:
+
+                def binary(env):
+                    a = left(env)
+                    if type(a) is int:
+                        result = a + b
+                        if result <= MAX_EXACT:
+                            return result
+                        return float(result)
+                    if type(a) is float:
+                        return a + b
+                    raise RuntimeError(
+                        operator, "Operands must be two numbers or two strings."
+                    )
+
+            case TokenType.MINUS if b >= 0:
+
+                def binary(env):
+                    a = left(env)
+                    if type(a) is int:
+                        result = a - b
+                        if result >= -MAX_EXACT:
+                            return result
+                        return float(result)
+                    if type(a) is float:
+                        return a - b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.STAR:
+
+                def binary(env):
+                    a = left(env)
+                    if type(a) is int:
+                        result = a * b
+                        if -MAX_EXACT <= result <= MAX_EXACT:
+                            return result
+                        return float(result)
+                    if type(a) is float:
+                        return a * b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.GREATER:
+
+                def binary(env):
+                    a = left(env)
+                    if type(a) in NUMBER_TYPES:
+                        return a > b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.GREATER_EQUAL:
+
+                def binary(env):
+                    a = left(env)
+                    if type(a) in NUMBER_TYPES:
+                        return a >= b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.LESS:
+
+                def binary(env):
+                    a = left(env)
+                    if type(a) in NUMBER_TYPES:
+                        return a < b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case TokenType.LESS_EQUAL:
+
+                def binary(env):
+                    a = left(env)
+                    if type(a) in NUMBER_TYPES:
+                        return a <= b
+                    raise RuntimeError(operator, "Operand must be a number")
+
+            case _:
+                return None
+
+        return binary
+
+    def visitCallExpr(self, expr):
+        callee = expr.callee.accept(self)
+        arguments = tuple(argument.accept(self) for argument in expr.arguments)
+        paren = expr.paren
+        interpreter = self.interpreter
+        checkCall = interpreter.checkCall
+
+        def call(env):
+            function = callee(env)
+            values = [argument(env) for argument in arguments]
+            checkCall(function, values, paren)
+            try:
+                return function.call(interpreter, values)
+            except RecursionError:
+                raise RuntimeError(paren, "Stack overflow.")
+
+        return call
+
+    def visitInvokeExpr(self, expr):
+        target = self.compileInvokeTarget(expr)
+        paren = expr.paren
+        interpreter = self.interpreter
+
+        def invoke(env):
+            function, instance, values = target(env)
+            try:
+                if instance is None:
+                    return function.call(interpreter, values)
+                return function.call(interpreter, values, instance)
+            except RecursionError:
+                raise RuntimeError(paren, "Stack overflow.")
+
+        return invoke
+
+    def compileInvokeTarget(self, expr):
+        # Same lookup and caches as visitGetExpr, but a method is returned
+        # unbound together with the instance to run it on.
+        obj = expr.obj.accept(self)
+        arguments = tuple(argument.accept(self) for argument in expr.arguments)
+        name = expr.name
+        lexeme = name.lexeme
+        paren = expr.paren
+        checkCall = self.interpreter.checkCall
+        cachedShape = None
+        cachedIndex = None
+        cachedClass = None
+        cachedMethod = None
+
+        def target(env):
+            nonlocal cachedShape, cachedIndex, cachedClass, cachedMethod
+            instance = obj(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError(name, "Only instances have properties.")
+
+            shape = instance.shape
+            if shape is not cachedShape:
+                cachedShape = shape
+                cachedIndex = shape.indexes.get(lexeme)
+            if cachedIndex is not None:
+                function = instance.values[cachedIndex]
+                instance = None
+            else:
+                klass = instance.klass
+                if klass is not cachedClass:
+                    method = klass.findMethod(lexeme)
+                    if method is None:
+                        raise RuntimeError(name, f"Undefined property '{lexeme}'.")
+                    cachedClass = klass
+                    cachedMethod = method
+                function = cachedMethod
+
+            values = [argument(env) for argument in arguments]
+            checkCall(function, values, paren)
+            return function, instance, values
+
+        return target
+
+    def visitGetExpr(self, expr):
+        obj = expr.obj.accept(self)
+        name = expr.name
+        lexeme = name.lexeme
+        # Monomorphic inline caches: the field index in the last shape this
+        # site saw (None when the shape has no such field), and the method
+        # found in the last class.
+        cachedShape = None
+        cachedIndex = None
+        cachedClass = None
+        cachedMethod = None
+
+        def get(env):
+            nonlocal cachedShape, cachedIndex, cachedClass, cachedMethod
+            instance = obj(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError(name, "Only instances have properties.")
+
+            shape = instance.shape
+            if shape is not cachedShape:
+                cachedShape = shape
+                cachedIndex = shape.indexes.get(lexeme)
+            if cachedIndex is not None:
+                return instance.values[cachedIndex]
+
+            klass = instance.klass
+            if klass is not cachedClass:
+                method = klass.findMethod(lexeme)
+                if method is None:
+                    raise RuntimeError(name, f"Undefined property '{lexeme}'.")
+                cachedClass = klass
+                cachedMethod = method
+            return cachedMethod.bind(instance)
+
+        return get
+
+    def visitGroupingExpr(self, expr):
+        return expr.expr.accept(self)
+
+    def visitLiteralExpr(self, expr):
+        value = expr.value
+
+        def literal(env):
+            return value
+
+        return literal
+
+    def visitLogicalExpr(self, expr):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+
+        if expr.operator.type == TokenType.OR:
+
+            def logical(env):
+                value = left(env)
+                if value is not None and value is not False:
+                    return value
+                return right(env)
+
+        else:
+
+            def logical(env):
+                value = left(env)
+                if value is None or value is False:
+                    return value
+                return right(env)
+
+        return logical
+
+    def visitSetExpr(self, expr):
+        obj = expr.obj.accept(self)
+        value = expr.value.accept(self)
+        lexeme = expr.name.lexeme
+        name = expr.name
+        # The last shape this site saw, with either the index of the field
+        # in it or the shape that adding the field leads to.
+        cachedShape = None
+        cachedIndex = None
+        cachedTransition = None
+
+        def set(env):
+            nonlocal cachedShape, cachedIndex, cachedTransition
+            instance = obj(env)
+            if not isinstance(instance, LoxInstance):
+                raise RuntimeError(name, "Only instances have fields.")
+            result = value(env)
+
+            shape = instance.shape
+            if shape is not cachedShape:
+                cachedShape = shape
+                cachedIndex = shape.indexes.get(lexeme)
+                cachedTransition = None
+                if cachedIndex is None:
+                    cachedTransition = shape.withField(lexeme)
+
+            if cachedTransition is None:
+                instance.values[cachedIndex] = result
+            else:
+                instance.shape = cachedTransition
+                instance.values.append(result)
+            return result
+
+        return set
+
+    def visitSuperExpr(self, expr):
+        getSuperclass = self.compileLookUp(expr.keyword, expr)
+        getThis = self.compileLookUp(expr.keyword, expr.keyword)
+        method = expr.method
+
+        def superExpr(env):
+            superclass = getSuperclass(env)
+            obj = getThis(env)
+            function = superclass.findMethod(method.lexeme)
+            if function is None:
+                raise RuntimeError(
+                    method, f"Undefinied property '{method.lexeme}'."
+                )
+            return function.bind(obj)
+
+        return superExpr
+
+    def visitSuperInvokeExpr(self, expr):
+        target = self.compileSuperInvokeTarget(expr)
+        paren = expr.paren
+        interpreter = self.interpreter
+
+        def superInvoke(env):
+            function, instance, values = target(env)
+            try:
+                return function.call(interpreter, values, instance)
+            except RecursionError:
+                raise RuntimeError(paren, "Stack overflow.")
+
+        return superInvoke
+
+    def compileSuperInvokeTarget(self, expr):
+        getSuperclass = self.compileLookUp(expr.keyword, expr)
+        getThis = self.compileLookUp(expr.keyword, expr.keyword)
+        arguments = tuple(argument.accept(self) for argument in expr.arguments)
+        method = expr.method
+        paren = expr.paren
+        checkCall = self.interpreter.checkCall
+        # The superclass only differs between runs of the class declaration,
+        # the method found in it is kept until it does.
+        cachedClass = None
+        cachedFunction = None
+
+        def target(env):
+            nonlocal cachedClass, cachedFunction
+            superclass = getSuperclass(env)
+            if superclass is not cachedClass:
+                function = superclass.findMethod(method.lexeme)
+                if function is None:
+                    raise RuntimeError(
+                        method, f"Undefinied property '{method.lexeme}'."
+                    )
+                cachedClass = superclass
+                cachedFunction = function
+
+            values = [argument(env) for argument in arguments]
+            checkCall(cachedFunction, values, paren)
+            return cachedFunction, getThis(env), values
+
+        return target
+
+    def visitThisExpr(self, expr):
+        return self.compileLookUp(expr.keyword, expr)
+
+    def visitUnaryExpr(self, expr):
+        right = expr.right.accept(self)
+        operator = expr.operator
+
+        if operator.type == TokenType.BANG:
+
+            def unary(env):
+                value = right(env)
+                return value is None or value is False
+
+        elif operator.type == TokenType.MINUS:
+
+            def unary(env):
+                value = right(env)
+                if type(value) in NUMBER_TYPES:
+                    return -value
+                raise RuntimeError(operator, "Operand must be a number")
+
+        else:
+
+            def unary(env):
+                right(env)
+                return None
+
+        return unary
+
+    def visitVariableExpr(self, expr):
+        return self.compileLookUp(expr.name, expr)
+
+    def visitAssignmentExpr(self, expr):
+        value = expr.value.accept(self)
+        name = expr.name
+        slot = getattr(expr, "resolved", None)
+
+        if slot is None:
+            globals = self.globals
+            cell = None
+
+            def assignment(env):
+                nonlocal cell
+                result = value(env)
+                if cell is None:
+                    cell = globals.cell(name)
+                cell.value = result
+                return result
+
+        elif slot[2]:
+            getCell = self.compileLocal(slot[0], slot[1])
+
+            def assignment(env):
+                result = value(env)
+                getCell(env).value = result
+                return result
+
+        elif slot[0] == 0:
+            index = slot[1]
+
+            def assignment(env):
+                result = value(env)
+                env.values[index] = result
+                return result
+
+        else:
+            distance, index, boxed = slot
+
+            def assignment(env):
+                result = value(env)
+                env.assignAt(distance, index, result)
+                return result
+
+        return assignment
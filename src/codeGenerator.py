@@ -0,0 +1,672 @@
+import math
+
+import Expr as Expr
+import Stmt as Stmt
+from ExprVisitor import ExprVisitor
+from StmtVisitor import StmtVisitor
+from resolver import FunctionType
+from token import TokenType
+
+
+class Binding:
+    def __init__(self, pyName, isDeclaration=False):
+        self.pyName = pyName
+        self.function = None
+        self.captured = False
+        self.assigned = False
+        self.isDeclaration = isDeclaration
+
+    def boxed(self):
+        # Captured variables are copied into the closures that use them when
+        # those are created. That is only safe for values that never change,
+        # everything else is shared through a one element list.
+        return self.captured and (self.assigned or self.isDeclaration)
+
+
+class FunctionInfo:
+    def __init__(self, enclosing):
+        self.enclosing = enclosing
+        self.freeVars = {}
+        self.globals = set()
+        self.this = None
+
+
+class BindingAnalyzer(ExprVisitor, StmtVisitor):
+    # Mirrors the scoping rules of the Resolver and records, for every
+    # variable reference, which declaration it refers to, which locals are
+    # captured or reassigned and which outer variables each function needs.
+    def __init__(self):
+        self.scopes = []
+        self.bindings = {}
+        self.functions = {}
+        self.counter = 0
+        self.function = FunctionInfo(None)
+
+    def analyze(self, statements):
+        for statement in statements:
+            statement.accept(self)
+        return self.function
+
+    def newName(self, prefix, lexeme):
+        self.counter += 1
+        return f"{prefix}{self.counter}_{lexeme}"
+
+    def declare(self, node, lexeme, isDeclaration=False):
+        if not self.scopes:
+            binding = Binding(f"g_{lexeme}")
+            self.function.globals.add(binding.pyName)
+        else:
+            binding = Binding(self.newName("l", lexeme), isDeclaration)
+            binding.function = self.function
+            self.scopes[-1][lexeme] = binding
+        self.bindings[node] = binding
+        return binding
+
+    def lookUp(self, node, lexeme, assign=False):
+        for scope in reversed(self.scopes):
+            if lexeme in scope:
+                binding = scope[lexeme]
+                break
+        else:
+            binding = Binding(f"g_{lexeme}")
+            if assign:
+                self.function.globals.add(binding.pyName)
+            self.bindings[node] = binding
+            return binding
+
+        if assign:
+            binding.assigned = True
+
+        function = self.function
+        while function is not binding.function:
+            binding.captured = True
+            function.freeVars[binding] = None
+            function = function.enclosing
+
+        self.bindings[node] = binding
+        return binding
+
+    def resolveFunction(self, stmt, type):
+        enclosing = self.function
+        self.function = FunctionInfo(enclosing)
+        self.functions[stmt] = self.function
+        self.scopes.append({})
+
+        if type in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            this = Binding(self.newName("l", "this"))
+            this.function = self.function
+            self.function.this = this
+            self.scopes[-1]["this"] = this
+
+        for param in stmt.params:
+            self.declare(param, param.lexeme)
+        for statement in stmt.body:
+            statement.accept(self)
+
+        self.scopes.pop()
+        self.function = enclosing
+
+    def visitExpressionStmt(self, stmt):
+        stmt.expression.accept(self)
+
+    def visitFunctionStmt(self, stmt):
+        self.declare(stmt, stmt.name.lexeme, isDeclaration=True)
+        self.resolveFunction(stmt, FunctionType.FUNCTION)
+
+    def visitPrintStmt(self, stmt):
+        stmt.expression.accept(self)
+
+    def visitReturnStmt(self, stmt):
+        if stmt.value is not None:
+            stmt.value.accept(self)
+
+    def visitVarStmt(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer.accept(self)
+        self.declare(stmt, stmt.name.lexeme)
+
+    def visitWhileStmt(self, stmt):
+        stmt.condition.accept(self)
+        stmt.body.accept(self)
+
+    def visitBlockStmt(self, stmt):
+        self.scopes.append({})
+        for statement in stmt.statements:
+            statement.accept(self)
+        self.scopes.pop()
+
+    def visitClassStmt(self, stmt):
+        self.declare(stmt, stmt.name.lexeme, isDeclaration=True)
+
+        if stmt.superclass is not None:
+            stmt.superclass.accept(self)
+            self.scopes.append({})
+            superclass = Binding(self.newName("l", "super"))
+            superclass.function = self.function
+            self.scopes[-1]["super"] = superclass
+            self.bindings[stmt.superclass.name] = superclass
+
+        for method in stmt.methods:
+            type = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                type = FunctionType.INITIALIZER
+            self.resolveFunction(method, type)
+
+        if stmt.superclass is not None:
+            self.scopes.pop()
+
+    def visitIfStmt(self, stmt):
+        stmt.condition.accept(self)
+        stmt.thenBranch.accept(self)
+        if stmt.elseBranch is not None:
+            stmt.elseBranch.accept(self)
+
+    def visitBinaryExpr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visitCallExpr(self, expr):
+        expr.callee.accept(self)
+        for argument in expr.arguments:
+            argument.accept(self)
+
+    def visitInvokeExpr(self, expr):
+        expr.obj.accept(self)
+        for argument in expr.arguments:
+            argument.accept(self)
+
+    def visitGetExpr(self, expr):
+        expr.obj.accept(self)
+
+    def visitGroupingExpr(self, expr):
+        expr.expr.accept(self)
+
+    def visitLiteralExpr(self, expr):
+        pass
+
+    def visitLogicalExpr(self, expr):
+        expr.left.accept(self)
+        expr.right.accept(self)
+
+    def visitSetExpr(self, expr):
+        expr.obj.accept(self)
+        expr.value.accept(self)
+
+    def visitSuperInvokeExpr(self, expr):
+        self.visitSuperExpr(expr)
+        for argument in expr.arguments:
+            argument.accept(self)
+
+    def visitSuperExpr(self, expr):
+        self.lookUp(expr, "super")
+        self.lookUp(expr.keyword, "this")
+
+    def visitThisExpr(self, expr):
+        self.lookUp(expr, "this")
+
+    def visitUnaryExpr(self, expr):
+        expr.right.accept(self)
+
+    def visitVariableExpr(self, expr):
+        self.lookUp(expr, expr.name.lexeme)
+
+    def visitAssignmentExpr(self, expr):
+        expr.value.accept(self)
+        self.lookUp(expr, expr.name.lexeme, assign=True)
+
+
+BOOLEAN_OPERATORS = (
+    TokenType.GREATER,
+    TokenType.GREATER_EQUAL,
+    TokenType.LESS,
+    TokenType.LESS_EQUAL,
+    TokenType.BANG_EQUAL,
+    TokenType.EQUAL_EQUAL,
+)
+
+# Python limits how deeply parentheses and loops nest in one function.
+# Expressions nested deeper than MAX_NESTING nodes, and loops nested deeper
+# than MAX_LOOPS, are moved into helper functions defined where they run.
+MAX_NESTING = 32
+MAX_LOOPS = 16
+
+ARITHMETIC_HELPERS = {
+    TokenType.PLUS: "_add",
+    TokenType.MINUS: "_sub",
+    TokenType.STAR: "_mul",
+    TokenType.SLASH: "_div",
+    TokenType.GREATER: "_gt",
+    TokenType.GREATER_EQUAL: "_ge",
+    TokenType.LESS: "_lt",
+    TokenType.LESS_EQUAL: "_le",
+}
+
+
+class CodeGenerator(ExprVisitor, StmtVisitor):
+    # Translates a resolved program into the source of a Python module that
+    # defines _main(). Lox functions become Python functions, Lox classes
+    # Python classes and Lox locals Python locals. lineMap[i] is the Lox
+    # line of the Python line i + 1.
+    def __init__(self):
+        self.output = []
+        self.lineMap = []
+        self.indent = 0
+        self.line = 1
+        self.temps = 0
+        self.initializerThis = None
+        # Heights of the expressions generated under the current one, and
+        # the loops around the current statement in this Python function.
+        self.heights = []
+        self.loops = 0
+        # Bindings this Python function rebinds or declares, so helpers
+        # hoisted out of it know which names they share with it.
+        self.rebound = []
+        self.declared = []
+        self.returns = 0
+
+    def generate(self, statements):
+        analyzer = BindingAnalyzer()
+        main = analyzer.analyze(statements)
+        self.bindings = analyzer.bindings
+        self.functions = analyzer.functions
+
+        self.emit("def _main():")
+        self.indent += 1
+        self.emitBody(main, statements)
+        self.indent -= 1
+        return "\n".join(self.output) + "\n", self.lineMap
+
+    def emit(self, text):
+        self.output.append("    " * self.indent + text)
+        self.lineMap.append(self.line)
+
+    def emitBody(self, function, statements, prologue=()):
+        start = len(self.output)
+        if function.globals:
+            self.emit(f"global {', '.join(sorted(function.globals))}")
+        for text in prologue:
+            self.emit(text)
+        for statement in statements:
+            statement.accept(self)
+        if len(self.output) == start:
+            self.emit("pass")
+
+    def temp(self):
+        self.temps += 1
+        return f"_t{self.temps}"
+
+    def helper(self):
+        self.temps += 1
+        return f"_h{self.temps}"
+
+    def expr(self, expr):
+        heights = self.heights
+        self.heights = []
+        rebound = len(self.rebound)
+        code = expr.accept(self)
+        height = 1 + max(self.heights, default=0)
+        self.heights = heights
+        if height >= MAX_NESTING:
+            code = self.hoistExpr(code, rebound)
+            height = 1
+        heights.append(height)
+        return code
+
+    def hoistExpr(self, code, rebound):
+        # The helper runs when and where the expression would have.
+        name = self.helper()
+        self.emit(f"def {name}():")
+        self.indent += 1
+        self.emitScope(len(self.output), rebound, len(self.declared))
+        self.emit(f"return {code}")
+        self.indent -= 1
+        return f"{name}()"
+
+    def hoistLoop(self, stmt):
+        name = self.helper()
+        self.emit(f"def {name}():")
+        self.indent += 1
+        start = len(self.output)
+        rebound = len(self.rebound)
+        declared = len(self.declared)
+        returns = self.returns
+        loops = self.loops
+        self.loops = 0
+        self.visitWhileStmt(stmt)
+        self.loops = loops
+        # A return in the loop returns from the helper, the caller passes
+        # it on unless the loop just ended.
+        hasReturn = self.returns != returns
+        if hasReturn:
+            self.emit("return _noReturn")
+        self.emitScope(start, rebound, declared)
+        self.indent -= 1
+
+        if hasReturn:
+            temp = self.temp()
+            self.emit(f"{temp} = {name}()")
+            self.emit(f"if {temp} is not _noReturn:")
+            self.emit(f"    return {temp}")
+            self.returns += 1
+        else:
+            self.emit(f"{name}()")
+
+    def emitScope(self, at, rebound, declared):
+        # Names a helper assigns are its own locals unless declared otherwise.
+        local = set(self.declared[declared:])
+        shared = {b for b in self.rebound[rebound:] if b not in local}
+        lines = []
+        globals = sorted(b.pyName for b in shared if b.function is None)
+        if globals:
+            lines.append(f"global {', '.join(globals)}")
+        nonlocals = sorted(b.pyName for b in shared if b.function is not None)
+        if nonlocals:
+            lines.append(f"nonlocal {', '.join(nonlocals)}")
+        for text in reversed(lines):
+            self.output.insert(at, "    " * self.indent + text)
+            self.lineMap.insert(at, self.line)
+
+    def truthy(self, expr):
+        if isBoolean(expr):
+            return self.expr(expr)
+        temp = self.temp()
+        return f"(({temp} := {self.expr(expr)}) is not None and {temp} is not False)"
+
+    def read(self, binding):
+        if binding.boxed():
+            return f"{binding.pyName}[0]"
+        return binding.pyName
+
+    def functionHeader(self, stmt, pyName):
+        info = self.functions[stmt]
+        params = [self.bindings[param].pyName for param in stmt.params]
+        if info.this is not None:
+            params.insert(0, info.this.pyName)
+        if info.freeVars:
+            params.append("*")
+            params.extend(f"{free.pyName}={free.pyName}" for free in info.freeVars)
+        return f"def {pyName}({', '.join(params)}):"
+
+    def emitFunction(self, stmt, pyName, isInitializer=False):
+        self.line = stmt.name.line
+        info = self.functions[stmt]
+        self.emit(self.functionHeader(stmt, pyName))
+
+        prologue = []
+        for param in stmt.params:
+            binding = self.bindings[param]
+            if binding.boxed():
+                prologue.append(f"{binding.pyName} = [{binding.pyName}]")
+
+        statements = list(stmt.body)
+        enclosingInitializer = self.initializerThis
+        self.initializerThis = None
+        if isInitializer:
+            self.initializerThis = info.this
+            statements.append(Stmt.Return(stmt.name, None))
+
+        enclosing = (self.loops, self.rebound, self.declared, self.returns)
+        self.loops = 0
+        self.rebound = []
+        self.declared = []
+        self.indent += 1
+        self.emitBody(info, statements, prologue)
+        self.indent -= 1
+        self.loops, self.rebound, self.declared, self.returns = enclosing
+        self.initializerThis = enclosingInitializer
+
+    def store(self, binding, value):
+        self.declared.append(binding)
+        if binding.boxed():
+            self.emit(f"{binding.pyName} = [{value}]")
+        else:
+            self.emit(f"{binding.pyName} = {value}")
+
+    def visitExpressionStmt(self, stmt):
+        expression = stmt.expression
+
+        if isinstance(expression, Expr.Assignment):
+            binding = self.bindings[expression]
+            value = self.expr(expression.value)
+            self.line = expression.name.line
+            if not binding.boxed():
+                self.rebound.append(binding)
+            if binding.function is None:
+                temp = self.temp()
+                self.emit(f"{temp} = {value}")
+                self.emit(f"if {binding.pyName!r} not in _G:")
+                self.emit(f"    _undefined({expression.name.lexeme!r}, {self.line})")
+                self.emit(f"{binding.pyName} = {temp}")
+            elif binding.boxed():
+                self.emit(f"{binding.pyName}[0] = {value}")
+            else:
+                self.emit(f"{binding.pyName} = {value}")
+            return
+
+        if isinstance(expression, Expr.Set) and isinstance(expression.obj, Expr.This):
+            obj = self.expr(expression.obj)
+            value = self.expr(expression.value)
+            self.emit(f"{obj}.f_{expression.name.lexeme} = {value}")
+            return
+
+        self.emit(self.expr(expression))
+
+    def visitFunctionStmt(self, stmt):
+        binding = self.bindings[stmt]
+        self.declared.append(binding)
+        if binding.boxed():
+            self.line = stmt.name.line
+            self.emit(f"{binding.pyName} = [None]")
+            pyName = f"d_{stmt.name.lexeme}"
+            self.emitFunction(stmt, pyName)
+            self.emit(f"{binding.pyName}[0] = {pyName}")
+        else:
+            self.emitFunction(stmt, binding.pyName)
+
+    def visitPrintStmt(self, stmt):
+        value = self.expr(stmt.expression)
+        self.emit(f"print(_stringify({value}))")
+
+    def visitReturnStmt(self, stmt):
+        self.line = stmt.keyword.line
+        self.returns += 1
+        if stmt.value is None:
+            if self.initializerThis is not None:
+                self.emit(f"return {self.read(self.initializerThis)}")
+            else:
+                self.emit("return None")
+        else:
+            self.emit(f"return {self.expr(stmt.value)}")
+
+    def visitVarStmt(self, stmt):
+        value = "None"
+        if stmt.initializer is not None:
+            value = self.expr(stmt.initializer)
+        self.line = stmt.name.line
+        self.store(self.bindings[stmt], value)
+
+    def visitWhileStmt(self, stmt):
+        if self.loops == MAX_LOOPS:
+            self.hoistLoop(stmt)
+            return
+
+        self.loops += 1
+        self.emit(f"while {self.truthy(stmt.condition)}:")
+        self.indent += 1
+        start = len(self.output)
+        stmt.body.accept(self)
+        if len(self.output) == start:
+            self.emit("pass")
+        self.indent -= 1
+        self.loops -= 1
+
+    def visitBlockStmt(self, stmt):
+        for statement in stmt.statements:
+            statement.accept(self)
+
+    def visitClassStmt(self, stmt):
+        binding = self.bindings[stmt]
+        self.declared.append(binding)
+        self.line = stmt.name.line
+
+        bases = "_LoxObject"
+        if stmt.superclass is not None:
+            superclass = self.bindings[stmt.superclass.name]
+            self.declared.append(superclass)
+            value = self.expr(stmt.superclass)
+            self.line = stmt.superclass.name.line
+            self.emit(f"{superclass.pyName} = _superclass({value}, {self.line})")
+            bases = superclass.pyName
+
+        pyName = binding.pyName
+        if binding.boxed():
+            self.emit(f"{binding.pyName} = [None]")
+            pyName = f"c_{stmt.name.lexeme}"
+
+        self.line = stmt.name.line
+        self.emit(f"class {pyName}({bases}):")
+        self.indent += 1
+        self.emit(f"loxName = {stmt.name.lexeme!r}")
+        for method in stmt.methods:
+            isInitializer = method.name.lexeme == "init"
+            self.emitFunction(method, f"f_{method.name.lexeme}", isInitializer)
+        self.indent -= 1
+
+        if binding.boxed():
+            self.emit(f"{binding.pyName}[0] = {pyName}")
+
+    def visitIfStmt(self, stmt):
+        self.emit(f"if {self.truthy(stmt.condition)}:")
+        self.indent += 1
+        start = len(self.output)
+        stmt.thenBranch.accept(self)
+        if len(self.output) == start:
+            self.emit("pass")
+        self.indent -= 1
+        if stmt.elseBranch is not None:
+            self.emit("else:")
+            self.indent += 1
+            start = len(self.output)
+            stmt.elseBranch.accept(self)
+            if len(self.output) == start:
+                self.emit("pass")
+            self.indent -= 1
+
+    def visitBinaryExpr(self, expr):
+        left = self.expr(expr.left)
+        right = self.expr(expr.right)
+        self.line = expr.operator.line
+
+        match expr.operator.type:
+            case TokenType.EQUAL_EQUAL:
+                return f"({left} == {right})"
+            case TokenType.BANG_EQUAL:
+                return f"({left} != {right})"
+
+        helper = ARITHMETIC_HELPERS[expr.operator.type]
+        return f"{helper}({left}, {right}, {self.line})"
+
+    def visitCallExpr(self, expr):
+        callee = self.expr(expr.callee)
+        arguments = [self.expr(argument) for argument in expr.arguments]
+        self.line = expr.paren.line
+        return f"_call({', '.join([callee, str(self.line)] + arguments)})"
+
+    def visitInvokeExpr(self, expr):
+        obj = self.expr(expr.obj)
+        self.line = expr.name.line
+        if isinstance(expr.obj, Expr.This):
+            callee = f"{obj}.f_{expr.name.lexeme}"
+        else:
+            callee = f"_get({obj}, 'f_{expr.name.lexeme}', {self.line})"
+        arguments = [self.expr(argument) for argument in expr.arguments]
+        self.line = expr.paren.line
+        return f"_call({', '.join([callee, str(self.line)] + arguments)})"
+
+    def visitGetExpr(self, expr):
+        obj = self.expr(expr.obj)
+        self.line = expr.name.line
+        if isinstance(expr.obj, Expr.This):
+            return f"{obj}.f_{expr.name.lexeme}"
+        return f"_get({obj}, 'f_{expr.name.lexeme}', {self.line})"
+
+    def visitGroupingExpr(self, expr):
+        return self.expr(expr.expr)
+
+    def visitLiteralExpr(self, expr):
+        value = expr.value
+        if isinstance(value, float) and not math.isfinite(value):
+            return f"float({str(value)!r})"
+        return repr(value)
+
+    def visitLogicalExpr(self, expr):
+        temp = self.temp()
+        left = self.expr(expr.left)
+        right = self.expr(expr.right)
+        test = f"(({temp} := {left}) is not None and {temp} is not False)"
+        if expr.operator.type == TokenType.OR:
+            return f"({temp} if {test} else {right})"
+        return f"({right} if {test} else {temp})"
+
+    def visitSetExpr(self, expr):
+        obj = self.expr(expr.obj)
+        self.line = expr.name.line
+        if not isinstance(expr.obj, Expr.This):
+            obj = f"_instance({obj}, {self.line})"
+        value = self.expr(expr.value)
+        return f"_set({obj}, 'f_{expr.name.lexeme}', {value})"
+
+    def visitSuperInvokeExpr(self, expr):
+        callee = self.visitSuperExpr(expr)
+        arguments = [self.expr(argument) for argument in expr.arguments]
+        self.line = expr.paren.line
+        return f"_call({', '.join([callee, str(self.line)] + arguments)})"
+
+    def visitSuperExpr(self, expr):
+        superclass = self.read(self.bindings[expr])
+        this = self.read(self.bindings[expr.keyword])
+        self.line = expr.method.line
+        return f"_super({superclass}, 'f_{expr.method.lexeme}', {this}, {self.line})"
+
+    def visitThisExpr(self, expr):
+        self.line = expr.keyword.line
+        return self.read(self.bindings[expr])
+
+    def visitUnaryExpr(self, expr):
+        right = self.expr(expr.right)
+        self.line = expr.operator.line
+        if expr.operator.type == TokenType.BANG:
+            temp = self.temp()
+            return f"(({temp} := {right}) is None or {temp} is False)"
+        return f"_neg({right}, {self.line})"
+
+    def visitVariableExpr(self, expr):
+        self.line = expr.name.line
+        return self.read(self.bindings[expr])
+
+    def visitAssignmentExpr(self, expr):
+        binding = self.bindings[expr]
+        value = self.expr(expr.value)
+        self.line = expr.name.line
+        if not binding.boxed():
+            self.rebound.append(binding)
+        if binding.function is None:
+            return (
+                f"({binding.pyName} := "
+                f"_checked(_G, {binding.pyName!r}, {value}, {self.line}))"
+            )
+        if binding.boxed():
+            return f"_setBox({binding.pyName}, {value})"
+        return f"({binding.pyName} := {value})"
+
+
+def isBoolean(expr):
+    if isinstance(expr, Expr.Binary):
+        return expr.operator.type in BOOLEAN_OPERATORS
+    if isinstance(expr, Expr.Unary):
+        return expr.operator.type == TokenType.BANG
+    if isinstance(expr, Expr.Grouping):
+        return isBoolean(expr.expr)
+    if isinstance(expr, Expr.Literal):
+        return isinstance(expr.value, bool)
+    return False
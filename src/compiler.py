@@ -0,0 +1,413 @@
+from ExprVisitor import ExprVisitor
+from StmtVisitor import StmtVisitor
+from chunk import FunctionProto
+from chunk import OpCode
+from resolver import FunctionType
+from sideEffects import isSimple
+from token import TokenType
+
+
+class Local:
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.isCaptured = False
+
+
+class FunctionState:
+    def __init__(self, enclosing, function, type):
+        self.enclosing = enclosing
+        self.function = function
+        self.type = type
+        self.upvalues = []
+        self.scopeDepth = 0
+
+        # Slot zero holds the receiver in methods and the callee otherwise.
+        if type in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            self.locals = [Local("this", 0)]
+        else:
+            self.locals = [Local("", 0)]
+
+
+class Compiler(ExprVisitor, StmtVisitor):
+    # Lowers a parsed and resolved program to bytecode for the VM. Locals
+    # live in stack slots and variables captured by closures are reached
+    # through upvalues, so the VM never builds Environment objects.
+    def __init__(self, errorHandler):
+        self.errorHandler = errorHandler
+        self.current = None
+        self.line = 1
+
+    def compile(self, statements):
+        self.current = FunctionState(None, FunctionProto(None), FunctionType.NONE)
+        for statement in statements:
+            self.compileStmt(statement)
+        return self.endFunction()
+
+    def compileStmt(self, stmt):
+        stmt.accept(self)
+
+    def compileExpr(self, expr):
+        expr.accept(self)
+
+    def chunk(self):
+        return self.current.function.chunk
+
+    def emit(self, *words):
+        chunk = self.chunk()
+        for word in words:
+            chunk.write(word, self.line)
+
+    def emitConstant(self, value):
+        self.emit(OpCode.CONSTANT, self.makeConstant(value))
+
+    def makeConstant(self, value):
+        index = self.chunk().addConstant(value)
+        if index > 0xFFFF:
+            self.errorHandler.error(self.line, "Too many constants in one chunk.")
+            return 0
+        return index
+
+    def emitJump(self, op):
+        self.emit(op, 0xFFFF)
+        return len(self.chunk().code) - 1
+
+    def patchJump(self, offset):
+        jump = len(self.chunk().code) - offset - 1
+        if jump > 0xFFFF:
+            self.errorHandler.error(self.line, "Too much code to jump over.")
+            return
+        self.chunk().code[offset] = jump
+
+    def emitLoop(self, loopStart):
+        offset = len(self.chunk().code) - loopStart + 2
+        if offset > 0xFFFF:
+            self.errorHandler.error(self.line, "Loop body too large.")
+            offset = 0
+        self.emit(OpCode.LOOP, offset)
+
+    def emitReturn(self):
+        if self.current.type == FunctionType.INITIALIZER:
+            self.emit(OpCode.GET_LOCAL, 0)
+        else:
+            self.emit(OpCode.NIL)
+        self.emit(OpCode.RETURN)
+
+    def endFunction(self):
+        self.emitReturn()
+        function = self.current.function
+        function.upvalueCount = len(self.current.upvalues)
+        return function
+
+    def beginScope(self):
+        self.current.scopeDepth += 1
+
+    def endScope(self):
+        state = self.current
+        state.scopeDepth -= 1
+        while state.locals and state.locals[-1].depth > state.scopeDepth:
+            if state.locals[-1].isCaptured:
+                self.emit(OpCode.CLOSE_UPVALUE)
+            else:
+                self.emit(OpCode.POP)
+            state.locals.pop()
+
+    def addLocal(self, name):
+        self.current.locals.append(Local(name, self.current.scopeDepth))
+
+    def declareVariable(self, name):
+        if self.current.scopeDepth > 0:
+            self.addLocal(name.lexeme)
+
+    def defineVariable(self, name):
+        if self.current.scopeDepth > 0:
+            return
+        self.emit(OpCode.DEFINE_GLOBAL, self.makeConstant(name.lexeme))
+
+    def resolveLocal(self, state, name):
+        for i in range(len(state.locals) - 1, -1, -1):
+            if state.locals[i].name == name:
+                return i
+        return -1
+
+    def addUpvalue(self, state, index, isLocal):
+        upvalue = (isLocal, index)
+        if upvalue in state.upvalues:
+            return state.upvalues.index(upvalue)
+        state.upvalues.append(upvalue)
+        return len(state.upvalues) - 1
+
+    def resolveUpvalue(self, state, name):
+        if state.enclosing is None:
+            return -1
+
+        local = self.resolveLocal(state.enclosing, name)
+        if local != -1:
+            state.enclosing.locals[local].isCaptured = True
+            return self.addUpvalue(state, local, True)
+
+        upvalue = self.resolveUpvalue(state.enclosing, name)
+        if upvalue != -1:
+            return self.addUpvalue(state, upvalue, False)
+
+        return -1
+
+    def namedVariable(self, name, assign=False):
+        slot = self.resolveLocal(self.current, name)
+        if slot != -1:
+            getOp, setOp = OpCode.GET_LOCAL, OpCode.SET_LOCAL
+        else:
+            slot = self.resolveUpvalue(self.current, name)
+            if slot != -1:
+                getOp, setOp = OpCode.GET_UPVALUE, OpCode.SET_UPVALUE
+            else:
+                slot = self.makeConstant(name)
+                getOp, setOp = OpCode.GET_GLOBAL, OpCode.SET_GLOBAL
+
+        self.emit(setOp if assign else getOp, slot)
+
+    def function(self, stmt, type):
+        self.line = stmt.name.line
+        function = FunctionProto(stmt.name.lexeme)
+        function.arity = len(stmt.params)
+        self.current = FunctionState(self.current, function, type)
+        self.beginScope()
+        for param in stmt.params:
+            self.addLocal(param.lexeme)
+        for statement in stmt.body:
+            self.compileStmt(statement)
+
+        state = self.current
+        self.endFunction()
+        self.current = state.enclosing
+
+        self.line = stmt.name.line
+        self.emit(OpCode.CLOSURE, self.makeConstant(function))
+        for isLocal, index in state.upvalues:
+            self.emit(1 if isLocal else 0, index)
+
+    def visitExpressionStmt(self, stmt):
+        self.compileExpr(stmt.expression)
+        self.emit(OpCode.POP)
+
+    def visitFunctionStmt(self, stmt):
+        self.declareVariable(stmt.name)
+        self.function(stmt, FunctionType.FUNCTION)
+        self.defineVariable(stmt.name)
+
+    def visitPrintStmt(self, stmt):
+        self.compileExpr(stmt.expression)
+        self.emit(OpCode.PRINT)
+
+    def visitReturnStmt(self, stmt):
+        self.line = stmt.keyword.line
+        if stmt.value is None:
+            self.emitReturn()
+        else:
+            self.compileExpr(stmt.value)
+            self.emit(OpCode.RETURN)
+
+    def visitVarStmt(self, stmt):
+        if stmt.initializer is None:
+            self.line = stmt.name.line
+            self.emit(OpCode.NIL)
+        else:
+            self.compileExpr(stmt.initializer)
+
+        self.line = stmt.name.line
+        self.declareVariable(stmt.name)
+        self.defineVariable(stmt.name)
+
+    def visitWhileStmt(self, stmt):
+        loopStart = len(self.chunk().code)
+        self.compileExpr(stmt.condition)
+        exitJump = self.emitJump(OpCode.JUMP_IF_FALSE)
+        self.emit(OpCode.POP)
+        self.compileStmt(stmt.body)
+        self.emitLoop(loopStart)
+        self.patchJump(exitJump)
+        self.emit(OpCode.POP)
+
+    def visitBlockStmt(self, stmt):
+        self.beginScope()
+        for statement in stmt.statements:
+            self.compileStmt(statement)
+        self.endScope()
+
+    def visitClassStmt(self, stmt):
+        name = stmt.name
+        self.line = name.line
+        nameConstant = self.makeConstant(name.lexeme)
+        self.declareVariable(name)
+        self.emit(OpCode.CLASS, nameConstant)
+        self.defineVariable(name)
+
+        if stmt.superclass is not None:
+            self.line = stmt.superclass.name.line
+            self.namedVariable(stmt.superclass.name.lexeme)
+            self.beginScope()
+            self.addLocal("super")
+            self.namedVariable(name.lexeme)
+            self.emit(OpCode.INHERIT)
+
+        self.namedVariable(name.lexeme)
+        for method in stmt.methods:
+            type = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                type = FunctionType.INITIALIZER
+            self.function(method, type)
+            self.emit(OpCode.METHOD, self.makeConstant(method.name.lexeme))
+        self.emit(OpCode.POP)
+
+        if stmt.superclass is not None:
+            self.endScope()
+
+    def visitIfStmt(self, stmt):
+        self.compileExpr(stmt.condition)
+        thenJump = self.emitJump(OpCode.JUMP_IF_FALSE)
+        self.emit(OpCode.POP)
+        self.compileStmt(stmt.thenBranch)
+        elseJump = self.emitJump(OpCode.JUMP)
+        self.patchJump(thenJump)
+        self.emit(OpCode.POP)
+        if stmt.elseBranch is not None:
+            self.compileStmt(stmt.elseBranch)
+        self.patchJump(elseJump)
+
+    def visitBinaryExpr(self, expr):
+        self.compileExpr(expr.left)
+        self.compileExpr(expr.right)
+        self.line = expr.operator.line
+
+        match expr.operator.type:
+            case TokenType.PLUS:
+                self.emit(OpCode.ADD)
+            case TokenType.MINUS:
+                self.emit(OpCode.SUBTRACT)
+            case TokenType.SLASH:
+                self.emit(OpCode.DIVIDE)
+            case TokenType.STAR:
+                self.emit(OpCode.MULTIPLY)
+            case TokenType.GREATER:
+                self.emit(OpCode.GREATER)
+            case TokenType.GREATER_EQUAL:
+                self.emit(OpCode.GREATER_EQUAL)
+            case TokenType.LESS:
+                self.emit(OpCode.LESS)
+            case TokenType.LESS_EQUAL:
+                self.emit(OpCode.LESS_EQUAL)
+            case TokenType.BANG_EQUAL:
+                self.emit(OpCode.NOT_EQUAL)
+            case TokenType.EQUAL_EQUAL:
+                self.emit(OpCode.EQUAL)
+
+    def visitCallExpr(self, expr):
+        self.compileExpr(expr.callee)
+        for argument in expr.arguments:
+            self.compileExpr(argument)
+        self.line = expr.paren.line
+        self.emit(OpCode.CALL, len(expr.arguments))
+
+    def visitInvokeExpr(self, expr):
+        self.compileExpr(expr.obj)
+        # INVOKE looks the method up after the arguments have run. When
+        # running them can be observed, the lookup is checked first, as the
+        # other backends do it.
+        if not all(isSimple(argument) for argument in expr.arguments):
+            self.line = expr.name.line
+            self.emit(OpCode.CHECK_PROPERTY, self.makeConstant(expr.name.lexeme))
+        for argument in expr.arguments:
+            self.compileExpr(argument)
+        self.line = expr.paren.line
+        self.emit(
+            OpCode.INVOKE,
+            self.makeConstant(expr.name.lexeme),
+            len(expr.arguments),
+        )
+
+    def visitSuperInvokeExpr(self, expr):
+        self.line = expr.keyword.line
+        self.namedVariable("this")
+        if not all(isSimple(argument) for argument in expr.arguments):
+            self.namedVariable("super")
+            self.line = expr.method.line
+            self.emit(OpCode.CHECK_SUPER, self.makeConstant(expr.method.lexeme))
+        for argument in expr.arguments:
+            self.compileExpr(argument)
+        self.line = expr.keyword.line
+        self.namedVariable("super")
+        self.line = expr.paren.line
+        self.emit(
+            OpCode.SUPER_INVOKE,
+            self.makeConstant(expr.method.lexeme),
+            len(expr.arguments),
+        )
+
+    def visitGetExpr(self, expr):
+        self.compileExpr(expr.obj)
+        self.line = expr.name.line
+        self.emit(OpCode.GET_PROPERTY, self.makeConstant(expr.name.lexeme))
+
+    def visitGroupingExpr(self, expr):
+        self.compileExpr(expr.expr)
+
+    def visitLiteralExpr(self, expr):
+        if expr.value is None:
+            self.emit(OpCode.NIL)
+        elif expr.value is True:
+            self.emit(OpCode.TRUE)
+        elif expr.value is False:
+            self.emit(OpCode.FALSE)
+        else:
+            self.emitConstant(expr.value)
+
+    def visitLogicalExpr(self, expr):
+        self.compileExpr(expr.left)
+        self.line = expr.operator.line
+
+        if expr.operator.type == TokenType.AND:
+            endJump = self.emitJump(OpCode.JUMP_IF_FALSE)
+            self.emit(OpCode.POP)
+            self.compileExpr(expr.right)
+            self.patchJump(endJump)
+        else:
+            elseJump = self.emitJump(OpCode.JUMP_IF_FALSE)
+            endJump = self.emitJump(OpCode.JUMP)
+            self.patchJump(elseJump)
+            self.emit(OpCode.POP)
+            self.compileExpr(expr.right)
+            self.patchJump(endJump)
+
+    def visitSetExpr(self, expr):
+        self.compileExpr(expr.obj)
+        self.compileExpr(expr.value)
+        self.line = expr.name.line
+        self.emit(OpCode.SET_PROPERTY, self.makeConstant(expr.name.lexeme))
+
+    def visitSuperExpr(self, expr):
+        self.line = expr.keyword.line
+        self.namedVariable("this")
+        self.namedVariable("super")
+        self.line = expr.method.line
+        self.emit(OpCode.GET_SUPER, self.makeConstant(expr.method.lexeme))
+
+    def visitThisExpr(self, expr):
+        self.line = expr.keyword.line
+        self.namedVariable("this")
+
+    def visitUnaryExpr(self, expr):
+        self.compileExpr(expr.right)
+        self.line = expr.operator.line
+        if expr.operator.type == TokenType.BANG:
+            self.emit(OpCode.NOT)
+        else:
+            self.emit(OpCode.NEGATE)
+
+    def visitVariableExpr(self, expr):
+        self.line = expr.name.line
+        self.namedVariable(expr.name.lexeme)
+
+    def visitAssignmentExpr(self, expr):
+        self.compileExpr(expr.value)
+        self.line = expr.name.line
+        self.namedVariable(expr.name.lexeme, assign=True)
@@ -1,10 +1,37 @@
+# Distance the Resolver reports for a variable captured from an enclosing
+# function; its index is then a position in the function's upvalues.
+UPVALUE = -1
+# Distance the Interpreter records for a global once it has found the
+# variable's cell; the index is then the Cell itself.
+GLOBAL = -2
+
+
+class Cell:
+    # Shared box for a captured variable that can change after it was
+    # captured, so the closure and the declaring scope see the same value.
+    __slots__ = ("value",)
+
+    def __init__(self, value=None):
+        self.value = value
+
+
 class Environment:
-    def __init__(self, enclosing=None):
-        self.values = {}
+    # Local scopes are plain frames: the Resolver gives every local a fixed
+    # slot, in declaration order, so variables are stored in a list and
+    # found by (distance, index) without hashing their names. The chain
+    # stops at the function boundary, anything from further out is one of
+    # the function's upvalues.
+    __slots__ = ("values", "enclosing", "upvalues")
+
+    def __init__(self, enclosing=None, upvalues=None):
+        self.values = []
         self.enclosing = enclosing
+        if upvalues is None and enclosing is not None:
+            upvalues = enclosing.upvalues
+        self.upvalues = upvalues
 
     def define(self, name, value):
-        self.values[name] = value
+        self.values.append(value)
 
     def ancestor(self, distance):
         i = 0
@@ -15,27 +42,56 @@ class Environment:
 
         return environment
 
-    def getAt(self, distance, name):
-        return self.ancestor(distance).values[name]
+    def getAt(self, distance, index):
+        return self.ancestor(distance).values[index]
 
-    def assignAt(self, distance, name, value):
-        self.ancestor(distance).values[name.lexeme] = value
+    def assignAt(self, distance, index, value):
+        self.ancestor(distance).values[index] = value
 
-    def get(self, name):
-        if name.lexeme in self.values:
-            return self.values[name.lexeme]
-        if self.enclosing is not None:
-            return self.enclosing.get(name)
 
-        raise RuntimeError(name, f"Undefined variable {name.lexeme}.")
+# Call frames are never referenced once their call returns, closures copy
+# what they capture, so returned frames are kept here and reused.
+MAX_FREE_FRAMES = 256
+freeFrames = []
+
+
+def newFrame(upvalues):
+    if freeFrames:
+        frame = freeFrames.pop()
+        frame.upvalues = upvalues
+        return frame
+    return Environment(None, upvalues)
 
-    def assign(self, name, value):
-        if name.lexeme in self.values:
-            self.values[name.lexeme] = value
-            return None
 
-        if self.enclosing is not None:
-            self.enclosing.assign(name, value)
-            return None
+def releaseFrame(frame):
+    frame.values.clear()
+    if len(freeFrames) < MAX_FREE_FRAMES:
+        freeFrames.append(frame)
 
-        raise RuntimeError(name, f"Undefined variable {name.lexeme}.")
+
+class GlobalEnvironment:
+    # Every global lives in a Cell that stays in place when the variable is
+    # redefined, so code referring to a global can keep its cell once found.
+    upvalues = ()
+
+    def __init__(self):
+        self.cells = {}
+
+    def define(self, name, value):
+        cell = self.cells.get(name)
+        if cell is None:
+            self.cells[name] = Cell(value)
+        else:
+            cell.value = value
+
+    def cell(self, name):
+        cell = self.cells.get(name.lexeme)
+        if cell is None:
+            raise RuntimeError(name, f"Undefined variable {name.lexeme}.")
+        return cell
+
+    def get(self, name):
+        return self.cell(name).value
+
+    def assign(self, name, value):
+        self.cell(name).value = value
@@ -1,26 +1,94 @@
+import operator
 from os import environ
 from Expr import Expr
+from Expr import Invoke
+from Expr import SuperInvoke
 from environment import Environment
+from environment import GlobalEnvironment
+from environment import Cell
+from environment import UPVALUE
+from environment import GLOBAL
 from ExprVisitor import ExprVisitor
 from StmtVisitor import StmtVisitor
 from loxCallable import LoxCallable
 from token import TokenType
 from token import Token
 from LoxClass import LoxClass
-from Return import ReturnValue
+from Return import RETURN
+from closureCompiler import ClosureCompiler
 
 import time
 
 from loxFunction import LoxFunction
 from LoxInstance import LoxInstance
+import loxNumber
+from loxValue import stringify
+from rope import STRING_TYPES
+from rope import concatenate
+
+# Calls of a function, and iterations of a loop, after which the tiered
+# interpreter compiles it with the ClosureCompiler.
+TIER_UP_CALLS = 50
+TIER_UP_ITERATIONS = 500
+
+
+# Binary and Unary nodes are quickened the first time they run: they keep
+# a handler for the operand types they saw, which checks that the types
+# still match and otherwise falls back to the generic path for good.
+def numberOperation(operation):
+    def handler(interpreter, expr, left, right):
+        if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+            return operation(left, right)
+        return interpreter.deoptimizeBinary(expr, left, right)
+
+    return handler
+
+
+def stringConcatenation(interpreter, expr, left, right):
+    if type(left) in STRING_TYPES and type(right) in STRING_TYPES:
+        return concatenate(left, right)
+    return interpreter.deoptimizeBinary(expr, left, right)
+
+
+def equal(interpreter, expr, left, right):
+    return interpreter.isEqual(left, right)
+
+
+def notEqual(interpreter, expr, left, right):
+    return not interpreter.isEqual(left, right)
+
+
+def numberNegation(interpreter, expr, right):
+    if type(right) in NUMBER_TYPES:
+        return -right
+    return interpreter.deoptimizeUnary(expr, right)
+
+
+def logicalNot(interpreter, expr, right):
+    return not interpreter.isTruthy(right)
+
+
+NUMBER_TYPES = loxNumber.NUMBER_TYPES
+NUMBER_OPERATIONS = {
+    TokenType.PLUS: numberOperation(loxNumber.add),
+    TokenType.MINUS: numberOperation(loxNumber.subtract),
+    TokenType.SLASH: numberOperation(loxNumber.divide),
+    TokenType.STAR: numberOperation(loxNumber.multiply),
+    TokenType.GREATER: numberOperation(operator.gt),
+    TokenType.GREATER_EQUAL: numberOperation(operator.ge),
+    TokenType.LESS: numberOperation(operator.lt),
+    TokenType.LESS_EQUAL: numberOperation(operator.le),
+}
 
 
 class Interpreter(ExprVisitor, StmtVisitor):
-    def __init__(self, errorHandler):
+    def __init__(self, errorHandler, tiered=False):
         self.errorHandler = errorHandler
-        self.globals = Environment()
+        self.globals = GlobalEnvironment()
         self.environment = self.globals
-        self.locals = {}
+        self.returnValue = None
+        self.tailCall = None
+        self.tiered = tiered
 
         class Clock(LoxCallable):
             def arity(self):
@@ -41,28 +109,36 @@ class Interpreter(ExprVisitor, StmtVisitor):
         except RuntimeError as error:
             self.errorHandler.runtimeError(error)
 
-    def stringify(self, object):
-        if object is None:
-            return "nil"
-        elif isinstance(object, float):
-            object = str(object)
-            if object.endswith(".0"):
-                return int(float(object))
-            else:
-                return object
-        elif isinstance(object, bool):
-            if object:
-                return "true"
-            else:
-                return "false"
-        else:
-            return str(object)
-
     def execute(self, stmt):
-        stmt.accept(self)
-
-    def resolve(self, expr, depth):
-        self.locals[expr] = depth
+        return stmt.accept(self)
+
+    # What the Resolver finds is kept on the nodes and tokens themselves, so
+    # it goes away with the AST once nothing can run that code any more.
+    def resolve(self, expr, depth, index, boxed, declaration):
+        expr.resolved = (depth, index, boxed)
+        expr.declaration = declaration
+
+    def resolveDeclaration(self, name, boxed, assigned):
+        name.boxed = boxed
+        name.assigned = assigned
+
+    def resolveReturn(self, stmt, isTailCall):
+        stmt.isTailCall = isTailCall
+
+    def resolveBlock(self, stmt, isEmpty):
+        stmt.isEmpty = isEmpty
+
+    def resolveFunction(self, declaration, upvalues, cells):
+        declaration.upvalues = upvalues
+        declaration.cells = cells
+
+    def capture(self, declaration, environment):
+        return tuple(
+            environment.upvalues[index]
+            if distance == UPVALUE
+            else environment.getAt(distance, index)
+            for distance, index in declaration.upvalues
+        )
 
     def evaluate(self, expression):
         return expression.accept(self)
@@ -84,44 +160,69 @@ class Interpreter(ExprVisitor, StmtVisitor):
     def checkNumberOperand(self, operator, operand, other=1.0):
         # Hacky way! In this way you can use the same function
         # to check for both binary and unary operators
-        if isinstance(operand, float) and isinstance(other, float):
+        if type(operand) in NUMBER_TYPES and type(other) in NUMBER_TYPES:
             return
         raise RuntimeError(operator, "Operand must be a number")
 
     def visitBinaryExpr(self, expr):
         left = self.evaluate(expr.left)
         right = self.evaluate(expr.right)
+        try:
+            quickened = expr.quickened
+        except AttributeError:
+            return self.quickenBinary(expr, left, right)
+        return quickened(self, expr, left, right)
+
+    def quickenBinary(self, expr, left, right):
+        operatorType = expr.operator.type
+        if operatorType == TokenType.EQUAL_EQUAL:
+            expr.quickened = equal
+        elif operatorType == TokenType.BANG_EQUAL:
+            expr.quickened = notEqual
+        elif type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+            expr.quickened = NUMBER_OPERATIONS[operatorType]
+        elif operatorType == TokenType.PLUS and type(left) in STRING_TYPES:
+            expr.quickened = stringConcatenation
+        else:
+            expr.quickened = Interpreter.binary
+        return self.binary(expr, left, right)
+
+    def deoptimizeBinary(self, expr, left, right):
+        expr.quickened = Interpreter.binary
+        return self.binary(expr, left, right)
+
+    def binary(self, expr, left, right):
         match expr.operator.type:
             case TokenType.PLUS:
-                if (isinstance(left, float) and isinstance(right, float)) or (
-                    isinstance(left, str) and isinstance(right, str)
-                ):
-                    return left + right
+                if loxNumber.isNumber(left) and loxNumber.isNumber(right):
+                    return loxNumber.add(left, right)
+                if type(left) in STRING_TYPES and type(right) in STRING_TYPES:
+                    return concatenate(left, right)
                 raise RuntimeError(
                     expr.operator, "Operands must be two numbers or two strings."
                 )
 
             case TokenType.MINUS:
                 self.checkNumberOperand(expr.operator, left, right)
-                return float(left) - float(right)
+                return loxNumber.subtract(left, right)
             case TokenType.SLASH:
                 self.checkNumberOperand(expr.operator, left, right)
-                return float(left) / float(right)
+                return loxNumber.divide(left, right)
             case TokenType.STAR:
                 self.checkNumberOperand(expr.operator, left, right)
-                return float(left) * float(right)
+                return loxNumber.multiply(left, right)
             case TokenType.GREATER:
                 self.checkNumberOperand(expr.operator, left, right)
-                return float(left) > float(right)
+                return left > right
             case TokenType.GREATER_EQUAL:
                 self.checkNumberOperand(expr.operator, left, right)
-                return float(left) >= float(right)
+                return left >= right
             case TokenType.LESS:
                 self.checkNumberOperand(expr.operator, left, right)
-                return float(left) < float(right)
+                return left < right
             case TokenType.LESS_EQUAL:
                 self.checkNumberOperand(expr.operator, left, right)
-                return float(left) <= float(right)
+                return left <= right
             case TokenType.BANG_EQUAL:
                 return not self.isEqual(left, right)
             case TokenType.EQUAL_EQUAL:
@@ -147,7 +248,24 @@ class Interpreter(ExprVisitor, StmtVisitor):
             raise RuntimeError(expr.name, "Only instances have fields.")
 
         value = self.evaluate(expr.value)
-        obj.set(expr.name, value)
+        # Like Get, with the shape a new field moves the instance on to.
+        shape = obj.shape
+        try:
+            cachedShape, index, transition = expr.cachedField
+        except AttributeError:
+            cachedShape = None
+        if shape is not cachedShape:
+            index = shape.indexes.get(expr.name.lexeme)
+            transition = None
+            if index is None:
+                transition = shape.withField(expr.name.lexeme)
+            expr.cachedField = (shape, index, transition)
+
+        if index is None:
+            obj.shape = transition
+            obj.values.append(value)
+        else:
+            obj.values[index] = value
         return value
 
     def visitThisExpr(self, expr):
@@ -161,12 +279,32 @@ class Interpreter(ExprVisitor, StmtVisitor):
 
     def visitUnaryExpr(self, expr):
         right = self.evaluate(expr.right)
+        try:
+            quickened = expr.quickened
+        except AttributeError:
+            return self.quickenUnary(expr, right)
+        return quickened(self, expr, right)
+
+    def quickenUnary(self, expr, right):
+        if expr.operator.type == TokenType.BANG:
+            expr.quickened = logicalNot
+        elif type(right) in NUMBER_TYPES:
+            expr.quickened = numberNegation
+        else:
+            expr.quickened = Interpreter.unary
+        return self.unary(expr, right)
+
+    def deoptimizeUnary(self, expr, right):
+        expr.quickened = Interpreter.unary
+        return self.unary(expr, right)
+
+    def unary(self, expr, right):
         match expr.operator.type:
             case TokenType.BANG:
                 return not self.isTruthy(right)
             case TokenType.MINUS:
                 self.checkNumberOperand(expr.operator, right)
-                return -float(right)
+                return -right
 
         return None
 
@@ -175,53 +313,117 @@ class Interpreter(ExprVisitor, StmtVisitor):
 
     def lookUpVariable(self, name, expr):
         try:
-            distance = self.locals[expr]
-            return self.environment.getAt(distance, name.lexeme)
-        except KeyError:
-            return self.globals.get(name)
+            distance, index, boxed = expr.resolved
+        except AttributeError:
+            return self.globalCell(name, expr).value
+
+        if distance == GLOBAL:
+            return index.value
+        if distance == UPVALUE:
+            value = self.environment.upvalues[index]
+        else:
+            value = self.environment.getAt(distance, index)
+        if boxed:
+            return value.value
+        return value
+
+    def globalCell(self, name, expr):
+        # The Resolver leaves globals out, the first lookup that finds the
+        # variable records its cell so later ones skip the name.
+        cell = self.globals.cell(name)
+        expr.resolved = (GLOBAL, cell, True)
+        return cell
 
     def visitExpressionStmt(self, stmt):
         self.evaluate(stmt.expression)
         return None
 
     def visitFunctionStmt(self, stmt):
-        function = LoxFunction(stmt, self.environment, False)
+        if stmt.name.boxed:
+            # The function can refer to itself, so its cell has to exist
+            # before the closure is made.
+            cell = Cell()
+            self.environment.define(stmt.name.lexeme, cell)
+            cell.value = LoxFunction(
+                stmt, self.capture(stmt, self.environment), False
+            )
+            return None
+
+        function = LoxFunction(stmt, self.capture(stmt, self.environment), False)
         self.environment.define(stmt.name.lexeme, function)
         return None
 
     def visitPrintStmt(self, stmt):
         value = self.evaluate(stmt.expression)
-        print(self.stringify(value))
+        print(stringify(value))
         return None
 
     def visitReturnStmt(self, stmt):
         value = None
-        if stmt.value is not None:
+        if stmt.isTailCall:
+            call = stmt.value
+            if isinstance(call, Invoke):
+                callee, instance, arguments = self.evaluateInvoke(call)
+            elif isinstance(call, SuperInvoke):
+                callee, instance, arguments = self.evaluateSuperInvoke(call)
+            else:
+                callee = self.evaluate(call.callee)
+                instance = None
+                arguments = []
+                for argument in call.arguments:
+                    arguments.append(self.evaluate(argument))
+                self.checkCall(callee, arguments, call.paren)
+
+            if isinstance(callee, LoxFunction):
+                if instance is None:
+                    instance = callee.instance
+                self.tailCall = (callee, instance, arguments)
+                return RETURN
+            value = callee.call(self, arguments)
+
+        elif stmt.value is not None:
             value = self.evaluate(stmt.value)
 
-        raise ReturnValue(value)
+        self.returnValue = value
+        return RETURN
 
     def visitVarStmt(self, stmt):
         value = None
         if stmt.initializer is not None:
             value = self.evaluate(stmt.initializer)
 
+        if stmt.name.boxed:
+            value = Cell(value)
         self.environment.define(stmt.name.lexeme, value)
         return None
 
     def visitAssignmentExpr(self, expr):
         value = self.evaluate(expr.value)
         try:
-            distance = self.locals[expr]
-            self.environment.assignAt(distance, expr.name, value)
-        except KeyError:
-            self.globals.assign(expr.name, value)
+            distance, index, boxed = expr.resolved
+        except AttributeError:
+            self.globalCell(expr.name, expr).value = value
+            return value
+
+        if not boxed:
+            self.environment.assignAt(distance, index, value)
+        elif distance == GLOBAL:
+            index.value = value
+        elif distance == UPVALUE:
+            self.environment.upvalues[index].value = value
+        else:
+            self.environment.getAt(distance, index).value = value
 
         return value
 
     def visitBlockStmt(self, stmt):
-        self.executeBlock(stmt.statements, Environment(self.environment))
-        return None
+        if stmt.isEmpty:
+            for statement in stmt.statements:
+                if self.execute(statement) is RETURN:
+                    return RETURN
+            return None
+
+        return self.executeBlock(stmt.statements, Environment(self.environment))
 
     def visitClassStmt(self, stmt):
         superclass = None
@@ -231,7 +433,10 @@ class Interpreter(ExprVisitor, StmtVisitor):
             if not isinstance(superclass, LoxClass):
                 raise RuntimeError(stmt.superclass.name, "Superclass must be a class.")
 
-        self.environment.define(stmt.name.lexeme, None)
+        cell = None
+        if stmt.name.boxed:
+            cell = Cell()
+            self.environment.define(stmt.name.lexeme, cell)
 
         if stmt.superclass is not None:
             self.environment = Environment(self.environment)
@@ -240,7 +445,9 @@ class Interpreter(ExprVisitor, StmtVisitor):
         methods = {}
         for method in stmt.methods:
             function = LoxFunction(
-                method, self.environment, method.name.lexeme == "init"
+                method,
+                self.capture(method, self.environment),
+                method.name.lexeme == "init",
             )
             methods[method.name.lexeme] = function
         klass = LoxClass(stmt.name.lexeme, superclass, methods)
@@ -248,7 +455,12 @@ class Interpreter(ExprVisitor, StmtVisitor):
         if superclass is not None:
             self.environment = self.environment.enclosing
 
-        self.environment.assign(stmt.name, klass)
+        if cell is not None:
+            cell.value = klass
+        else:
+            # Nothing can read the class variable while its methods are
+            # being built, so it is defined once the class exists.
+            self.environment.define(stmt.name.lexeme, klass)
         return None
 
     def executeBlock(self, stmtList, environment):
@@ -256,59 +468,239 @@ class Interpreter(ExprVisitor, StmtVisitor):
         try:
             self.environment = environment
             for statement in stmtList:
-                self.execute(statement)
+                if self.execute(statement) is RETURN:
+                    return RETURN
+            return None
 
         finally:
             self.environment = previousEnv
 
     def visitIfStmt(self, stmt):
         if self.isTruthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.thenBranch)
+            return self.execute(stmt.thenBranch)
         elif stmt.elseBranch is not None:
-            self.execute(stmt.elseBranch)
+            return self.execute(stmt.elseBranch)
 
         return None
 
     def visitWhileStmt(self, stmt):
-        while self.isTruthy(self.evaluate(stmt.condition)):
-            self.execute(stmt.body)
+        if not self.tiered:
+            while self.isTruthy(self.evaluate(stmt.condition)):
+                if self.execute(stmt.body) is RETURN:
+                    return RETURN
+            return None
 
+        compiled = getattr(stmt, "compiled", None)
+        if compiled is not None:
+            return compiled(self.environment)
+
+        iterations = getattr(stmt, "iterations", 0)
+        while self.isTruthy(self.evaluate(stmt.condition)):
+            if self.execute(stmt.body) is RETURN:
+                stmt.iterations = iterations
+                return RETURN
+            iterations += 1
+            if iterations == TIER_UP_ITERATIONS:
+                # Finish the remaining iterations in compiled code, the
+                # condition is the next thing either tier evaluates.
+                compiled = self.tierUp(stmt, [stmt])
+                if compiled is not None:
+                    stmt.iterations = iterations
+                    return compiled(self.environment)
+
+        stmt.iterations = iterations
         return None
 
+    def executeFunction(self, declaration, environment):
+        cells = declaration.cells
+        if cells:
+            values = environment.values
+            for index in cells:
+                values[index] = Cell(values[index])
+
+        if self.tiered:
+            compiled = getattr(declaration, "compiled", None)
+            if compiled is None:
+                calls = getattr(declaration, "calls", 0) + 1
+                declaration.calls = calls
+                if calls == TIER_UP_CALLS:
+                    compiled = self.tierUp(declaration, declaration.body)
+            if compiled is not None:
+                return compiled(environment)
+
+        return self.executeBlock(declaration.body, environment)
+
+    def tierUp(self, node, statements):
+        # Compiled code reads globals through their cells and checks its
+        # caches on every use, so nothing a later line redefines can make it
+        # wrong. It only goes back to the tree-walker when it can't compile.
+        try:
+            compiled = ClosureCompiler(self).compile(statements)
+        except RecursionError:
+            # Code nested too deep for the compiler to walk, keep
+            # interpreting it.
+            self.deoptimize(node)
+            return None
+
+        node.compiled = compiled
+        return compiled
+
+    def deoptimize(self, node):
+        node.compiled = None
+        node.calls = TIER_UP_CALLS
+        node.iterations = TIER_UP_ITERATIONS
+
     def visitCallExpr(self, expr):
         callee = self.evaluate(expr.callee)
         arguments = []
         for argument in expr.arguments:
             arguments.append(self.evaluate(argument))
 
-        if not isinstance(callee, LoxCallable):
-            raise RuntimeError(expr.paren, "Can only call functions and classes.")
+        self.checkCall(callee, arguments, expr.paren)
+        try:
+            return callee.call(self, arguments)
+        except RecursionError:
+            # Every Lox call nests several Python frames, the vm backend is
+            # the one to use for deep recursion.
+            raise RuntimeError(expr.paren, "Stack overflow.")
+
+    def visitInvokeExpr(self, expr):
+        function, instance, arguments = self.evaluateInvoke(expr)
+        try:
+            if instance is None:
+                return function.call(self, arguments)
+            return function.call(self, arguments, instance)
+        except RecursionError:
+            raise RuntimeError(expr.paren, "Stack overflow.")
+
+    def evaluateInvoke(self, expr):
+        # Finds what obj.name(...) calls the way Get would, except that a
+        # method comes back unbound, together with the instance to run it on.
+        obj = self.evaluate(expr.obj)
+        if not isinstance(obj, LoxInstance):
+            raise RuntimeError(expr.name, "Only instances have properties.")
+
+        instance = None
+        shape = obj.shape
+        try:
+            cachedShape, index = expr.cachedField
+        except AttributeError:
+            cachedShape = None
+        if shape is not cachedShape:
+            index = shape.indexes.get(expr.name.lexeme)
+            expr.cachedField = (shape, index)
+        if index is not None:
+            function = obj.values[index]
+        else:
+            klass = obj.klass
+            try:
+                cachedClass, function = expr.cachedMethod
+            except AttributeError:
+                cachedClass = None
+            if klass is not cachedClass:
+                function = klass.findMethod(expr.name.lexeme)
+                expr.cachedMethod = (klass, function)
+            if function is None:
+                raise RuntimeError(
+                    expr.name, f"Undefined property '{expr.name.lexeme}'."
+                )
+            instance = obj
+
+        arguments = []
+        for argument in expr.arguments:
+            arguments.append(self.evaluate(argument))
+
+        self.checkCall(function, arguments, expr.paren)
+        return function, instance, arguments
+
+    def visitSuperInvokeExpr(self, expr):
+        function, instance, arguments = self.evaluateSuperInvoke(expr)
+        try:
+            return function.call(self, arguments, instance)
+        except RecursionError:
+            raise RuntimeError(expr.paren, "Stack overflow.")
+
+    def evaluateSuperInvoke(self, expr):
+        superclass = self.lookUpVariable(expr.keyword, expr)
+        instance = self.lookUpVariable(expr.keyword, expr.keyword)
 
-        function = callee
-        if len(arguments) != function.arity():
+        # The superclass only changes when the class declaration runs again,
+        # so the node keeps the method it found in the last one.
+        try:
+            cachedClass, function = expr.cachedMethod
+        except AttributeError:
+            cachedClass = None
+        if superclass is not cachedClass:
+            function = superclass.findMethod(expr.method.lexeme)
+            expr.cachedMethod = (superclass, function)
+        if function is None:
             raise RuntimeError(
-                expr.paren,
-                f"Expected {function.arity()} arguments but got {len(arguments)}.",
+                expr.method, f"Undefinied property '{expr.method.lexeme}'."
             )
 
-        return function.call(self, arguments)
+        arguments = []
+        for argument in expr.arguments:
+            arguments.append(self.evaluate(argument))
+
+        self.checkCall(function, arguments, expr.paren)
+        return function, instance, arguments
+
+    def checkCall(self, callee, arguments, paren):
+        if not isinstance(callee, LoxCallable):
+            raise RuntimeError(paren, "Can only call functions and classes.")
+
+        if len(arguments) != callee.arity():
+            raise RuntimeError(
+                paren,
+                f"Expected {callee.arity()} arguments but got {len(arguments)}.",
+            )
 
     def visitGetExpr(self, expr):
         obj = self.evaluate(expr.obj)
-        if isinstance(obj, LoxInstance):
-            return obj.get(expr.name)
+        if not isinstance(obj, LoxInstance):
+            raise RuntimeError(
+                expr.name,
+                "Only instances have properties.",
+            )
 
-        raise RuntimeError(
-            expr.name,
-            "Only instances have properties.",
-        )
+        # The node keeps the field's index in the last shape it saw, so
+        # instances of that shape skip the name lookup.
+        shape = obj.shape
+        try:
+            cachedShape, index = expr.cachedField
+        except AttributeError:
+            cachedShape = None
+        if shape is not cachedShape:
+            index = shape.indexes.get(expr.name.lexeme)
+            expr.cachedField = (shape, index)
+        if index is not None:
+            return obj.values[index]
+
+        # Methods can't change once the class exists, so the node also
+        # remembers the last class it found the method in.
+        klass = obj.klass
+        try:
+            cachedClass, method = expr.cachedMethod
+        except AttributeError:
+            cachedClass = None
+        if klass is not cachedClass:
+            method = klass.findMethod(expr.name.lexeme)
+            expr.cachedMethod = (klass, method)
+        if method is None:
+            raise RuntimeError(expr.name, f"Undefined property '{expr.name.lexeme}'.")
+        return method.bind(obj)
 
     def visitSuperExpr(self, expr):
-        distance = self.locals[expr]
-        superclass = self.environment.getAt(distance, "super")
-        obj = self.environment.getAt(distance - 1, "this")
+        superclass = self.lookUpVariable(expr.keyword, expr)
+        obj = self.lookUpVariable(expr.keyword, expr.keyword)
 
-        method = superclass.findMethod(expr.method.lexeme)
+        try:
+            cachedClass, method = expr.cachedMethod
+        except AttributeError:
+            cachedClass = None
+        if superclass is not cachedClass:
+            method = superclass.findMethod(expr.method.lexeme)
+            expr.cachedMethod = (superclass, method)
         if method is None:
             raise RuntimeError(
                 expr.method, f"Undefinied property '{expr.method.lexeme}'."
@@ -3,21 +3,44 @@ import sys
 from scanner import Scanner
 from parser import Parser
 from resolver import Resolver
+from optimizer import Optimizer
 from interpreter import Interpreter
+from closureCompiler import ClosureCompiler
+from compiler import Compiler
+from vm import VM
+from vm import FRAMES_MAX
+from pythonBackend import PythonBackend
 from errorHandler import ErrorHandler
 
 
 class Lox:
-    def __init__(self) -> None:
+    # Only the vm backend keeps Lox calls off the Python stack, framesMax
+    # bounds its call depth. Every other backend nests Python frames for
+    # each Lox call, so non-tail recursion reports "Stack overflow." at
+    # Python's recursion limit, which the default interpreter reaches at
+    # about 80 Lox calls. Deeply recursive programs should use the vm.
+    def __init__(self, backend="interpreter", framesMax=FRAMES_MAX) -> None:
         self.errorHandler = ErrorHandler()
         self.interpreter = Interpreter(self.errorHandler)
+        self.vm = VM(self.errorHandler, framesMax)
+        self.pythonBackend = PythonBackend(self.errorHandler)
+        self.backend = backend
 
     def main(self):
-        if len(sys.argv) > 2:
-            print("Usage: pylox [script]")
+        args = sys.argv[1:]
+        if len(args) > 0 and args[0].startswith("--backend="):
+            self.backend = args.pop(0).split("=", 1)[1]
+        if len(args) > 0 and args[0].startswith("--frames-max="):
+            self.vm.framesMax = int(args.pop(0).split("=", 1)[1])
+
+        if len(args) > 1:
+            print(
+                "Usage: pylox [--backend=interpreter|tiered|closure|vm|python]"
+                " [--frames-max=N] [script]"
+            )
             quit()
-        elif len(sys.argv) == 2:
-            self.runFile(sys.argv[1])
+        elif len(args) == 1:
+            self.runFile(args[0])
         else:
             self.runPrompt()
 
@@ -25,7 +48,7 @@ class Lox:
         with open(path) as f:
             program = "".join(f.readlines())
 
-        self.run(program)
+        self.run(program, wholeProgram=True)
 
         if self.errorHandler.hadError:
             sys.exit(65)
@@ -41,7 +64,19 @@ class Lox:
             self.run(line)
             self.errorHandler.hadError = False
 
-    def run(self, source):
+    def run(self, source, backend=None, wholeProgram=False, optimize=True):
+        # wholeProgram says no later source will run against the same
+        # globals, which lets the optimizer inline global functions.
+        # optimize=False runs the program as written, without the optimizer.
+        if backend is None:
+            backend = self.backend
+
+        if backend == "python":
+            program = self.pythonBackend.load(source, wholeProgram, optimize)
+            if program is not None:
+                self.pythonBackend.execute(program)
+                return
+
         scanner = Scanner(source, self.errorHandler)
         tokens = scanner.scanTokens()
 
@@ -60,7 +95,32 @@ class Lox:
         if self.errorHandler.hadError:
             return
 
-        self.interpreter.interpret(statements)
+        if optimize:
+            optimizer = Optimizer()
+            if wholeProgram:
+                optimizer.findGlobalFunctions(statements, resolver.globalAssignments)
+            statements = optimizer.optimize(statements)
+            if optimizer.stale:
+                Resolver(self.interpreter, self.errorHandler).resolve(statements)
+
+        if backend == "closure":
+            ClosureCompiler(self.interpreter).run(statements)
+        elif backend == "vm":
+            function = Compiler(self.errorHandler).compile(statements)
+            if self.errorHandler.hadError:
+                return
+            self.vm.interpret(function)
+        elif backend == "python":
+            program = self.pythonBackend.compile(
+                source, statements, wholeProgram, optimize
+            )
+            if program is None:
+                ClosureCompiler(self.interpreter).run(statements)
+            else:
+                self.pythonBackend.execute(program)
+        else:
+            self.interpreter.tiered = backend == "tiered"
+            self.interpreter.interpret(statements)
 
 
 if __name__ == "__main__":
@@ -1,37 +1,63 @@
 from loxCallable import LoxCallable
-from environment import Environment
-from Return import ReturnValue
+from environment import newFrame
+from environment import releaseFrame
+from Return import RETURN
 
 
 class LoxFunction(LoxCallable):
-    def __init__(self, declaration, closure, isInitializer):
+    # Compiled functions keep their compiled body here.
+    body = None
+
+    def __init__(self, declaration, upvalues, isInitializer, instance=None):
         self.isInitializer = isInitializer
         self.declaration = declaration
-        self.closure = closure
-
-    def call(self, interpreter, arguments):
-        environment = Environment(self.closure)
-        for decl, arg in zip(self.declaration.params, arguments):
-            environment.define(decl.lexeme, arg)
-
-        try:
-            interpreter.executeBlock(self.declaration.body, environment)
-        except ReturnValue as r:
-            if self.isInitializer:
-                return self.closure.getAt(0, "this")
-            return r.value
-
-        if self.isInitializer:
-            return self.closure.getAt(0, "this")
-        return None
+        self.upvalues = upvalues
+        self.instance = instance
+
+    def call(self, interpreter, arguments, instance=None):
+        # Method calls pass the instance for `this` here instead of calling
+        # a bound copy of the method.
+        if instance is None:
+            instance = self.instance
+        function = self
+        while True:
+            environment = newFrame(function.upvalues)
+            if instance is not None:
+                environment.define("this", instance)
+            environment.values.extend(arguments)
+
+            try:
+                # Interpreted bodies are run straight from here, another
+                # method in between would cost every call a Python frame.
+                if function.body is None:
+                    completion = interpreter.executeFunction(
+                        function.declaration, environment
+                    )
+                else:
+                    completion = function.execute(interpreter, environment)
+            finally:
+                releaseFrame(environment)
+
+            if interpreter.tailCall is not None:
+                # The function ended in a tail call, which runs here in
+                # place of it so the Python stack doesn't grow.
+                function, instance, arguments = interpreter.tailCall
+                interpreter.tailCall = None
+                continue
+
+            if function.isInitializer:
+                return instance
+            if completion is RETURN:
+                return interpreter.returnValue
+            return None
 
     def arity(self):
         return len(self.declaration.params)
 
     def bind(self, instance):
-        environment = Environment(self.closure)
-        environment.define("this", instance)
-        return LoxFunction(self.declaration, environment, self.isInitializer)
+        return LoxFunction(
+            self.declaration, self.upvalues, self.isInitializer, instance
+        )
 
     def __str__(self):
         return f"<fn {self.declaration.name.lexeme}>"
@@ -0,0 +1,45 @@
+# Lox numbers are doubles. Integral values are kept as Python ints for as
+# long as a double would hold them exactly too, which makes counters and
+# indexes cheaper. Results outside that range, and divisions that don't
+# come out even, become floats rounded the way a double would round them,
+# so a program can't tell the two apart.
+MAX_EXACT = 2**53
+NUMBER_TYPES = (int, float)
+
+
+def isNumber(value):
+    return type(value) in NUMBER_TYPES
+
+
+def number(text):
+    value = float(text)
+    if value.is_integer() and -MAX_EXACT <= value <= MAX_EXACT:
+        return int(value)
+    return value
+
+
+def add(a, b):
+    result = a + b
+    if type(result) is int and not -MAX_EXACT <= result <= MAX_EXACT:
+        return float(result)
+    return result
+
+
+def subtract(a, b):
+    result = a - b
+    if type(result) is int and not -MAX_EXACT <= result <= MAX_EXACT:
+        return float(result)
+    return result
+
+
+def multiply(a, b):
+    result = a * b
+    if type(result) is int and not -MAX_EXACT <= result <= MAX_EXACT:
+        return float(result)
+    return result
+
+
+def divide(a, b):
+    if type(a) is int and type(b) is int and b != 0 and a % b == 0:
+        return a // b
+    return a / b
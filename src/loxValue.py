@@ -0,0 +1,17 @@
+# How print shows a Lox value, shared by every backend.
+def stringify(object):
+    if object is None:
+        return "nil"
+    elif isinstance(object, float):
+        object = str(object)
+        if object.endswith(".0"):
+            return int(float(object))
+        else:
+            return object
+    elif isinstance(object, bool):
+        if object:
+            return "true"
+        else:
+            return "false"
+    else:
+        return str(object)
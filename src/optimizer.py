@@ -0,0 +1,378 @@
+import operator
+
+import loxNumber
+from ExprVisitor import ExprVisitor
+from StmtVisitor import StmtVisitor
+from Expr import Binary
+from Expr import Grouping
+from Expr import Literal
+from Expr import Logical
+from Expr import Unary
+from Expr import Variable
+from Stmt import Block
+from Stmt import Function
+from Stmt import Return
+from Stmt import Var
+from sideEffects import isPure
+from sideEffects import isSimple
+from token import TokenType
+
+
+# The most nodes a function's return expression may have for it to be
+# copied into its call sites.
+INLINE_BUDGET = 16
+
+
+def isTruthy(value):
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        return value
+    return True
+
+
+def isEqual(a, b):
+    if a is None and b is None:
+        return True
+    if a is None:
+        return False
+    return a == b
+
+
+def inlineSize(expr, params):
+    # Only operators on literals and parameters are inlined. They can't
+    # have side effects, and a call site can't see the names the function
+    # would otherwise refer to. Returns None for anything else.
+    if isinstance(expr, Literal):
+        return 1
+    if isinstance(expr, Variable):
+        if getattr(expr, "declaration", None) in params:
+            return 1
+        return None
+    if isinstance(expr, Grouping):
+        size = inlineSize(expr.expr, params)
+    elif isinstance(expr, Unary):
+        size = inlineSize(expr.right, params)
+    elif isinstance(expr, (Binary, Logical)):
+        left = inlineSize(expr.left, params)
+        right = inlineSize(expr.right, params)
+        size = None if left is None or right is None else left + right
+    else:
+        return None
+    if size is None:
+        return None
+    return size + 1
+
+
+def substitute(expr, arguments):
+    if isinstance(expr, Literal):
+        return expr
+    if isinstance(expr, Variable):
+        return arguments[expr.declaration]
+    if isinstance(expr, Grouping):
+        return Grouping(substitute(expr.expr, arguments))
+    if isinstance(expr, Unary):
+        return Unary(expr.operator, substitute(expr.right, arguments))
+    return type(expr)(
+        substitute(expr.left, arguments),
+        expr.operator,
+        substitute(expr.right, arguments),
+    )
+
+
+NUMBER_FOLDS = {
+    TokenType.PLUS: loxNumber.add,
+    TokenType.MINUS: loxNumber.subtract,
+    TokenType.STAR: loxNumber.multiply,
+    TokenType.SLASH: loxNumber.divide,
+    TokenType.GREATER: operator.gt,
+    TokenType.GREATER_EQUAL: operator.ge,
+    TokenType.LESS: operator.lt,
+    TokenType.LESS_EQUAL: operator.le,
+}
+
+
+class Optimizer(ExprVisitor, StmtVisitor):
+    # Rewrites a resolved program before it runs. Operations on literals are
+    # folded into a single Literal and locals that are never assigned after
+    # being initialised to a literal are replaced by it. Anything that would
+    # fail is left alone, so the error is still raised when it runs, on the
+    # line it was written on.
+    #
+    # Statements that can't run are dropped: those after a return, branches
+    # a literal condition never takes and declarations of locals nobody
+    # reads. Whether a local is read is only known once the rest of its
+    # block has been optimized, so unused declarations are removed last.
+    #
+    # Calls of functions that just return an expression of their parameters
+    # are replaced by that expression when the arguments are simple enough
+    # to be substituted. Local functions qualify when they're never assigned.
+    # Global ones qualify only when the source is the whole program and it
+    # declares the name once and never assigns it, so nothing can replace
+    # them. Calls before the declaration are left alone.
+    #
+    # Pruning and inlining move slots and change which returns are tail
+    # calls, so the program has to be resolved again when the result is
+    # stale.
+    def __init__(self):
+        self.constants = {}
+        self.functions = {}
+        self.globalFunctions = {}
+        self.inlinableGlobals = set()
+        self.reads = set()
+        self.stale = False
+
+    def findGlobalFunctions(self, statements, globalAssignments):
+        declarations = {}
+        for statement in statements:
+            name = getattr(statement, "name", None)
+            if name is not None:
+                declarations[name.lexeme] = declarations.get(name.lexeme, 0) + 1
+
+        for statement in statements:
+            if (
+                isinstance(statement, Function)
+                and declarations[statement.name.lexeme] == 1
+                and statement.name.lexeme not in globalAssignments
+            ):
+                self.inlinableGlobals.add(statement)
+
+    def optimize(self, statements):
+        optimized = []
+        for statement in statements:
+            statement = self.optimizeStmt(statement)
+            if statement is None:
+                continue
+            optimized.append(statement)
+            if isinstance(statement, Return):
+                break
+        optimized = [
+            statement for statement in optimized if not self.isUnused(statement)
+        ]
+        if len(optimized) != len(statements):
+            self.stale = True
+        statements[:] = optimized
+        return statements
+
+    def optimizeStmt(self, stmt):
+        return stmt.accept(self)
+
+    def optimizeBranch(self, stmt):
+        stmt = self.optimizeStmt(stmt)
+        if stmt is None:
+            self.stale = True
+            return Block([])
+        return stmt
+
+    def optimizeExpr(self, expr):
+        return expr.accept(self)
+
+    def visitBlockStmt(self, stmt):
+        self.optimize(stmt.statements)
+        return stmt
+
+    def visitClassStmt(self, stmt):
+        # A superclass is looked up as a variable, even a constant one, so
+        # its error can be reported there.
+        if stmt.superclass is not None:
+            self.read(stmt.superclass)
+        for method in stmt.methods:
+            self.optimize(method.body)
+        return stmt
+
+    def visitExpressionStmt(self, stmt):
+        stmt.expression = self.optimizeExpr(stmt.expression)
+        return stmt
+
+    def visitFunctionStmt(self, stmt):
+        self.optimize(stmt.body)
+        if not self.isInlinable(stmt):
+            return stmt
+
+        if stmt in self.inlinableGlobals:
+            self.globalFunctions[stmt.name.lexeme] = stmt
+        elif not getattr(stmt.name, "assigned", True):
+            self.functions[stmt.name] = stmt
+        return stmt
+
+    def visitIfStmt(self, stmt):
+        stmt.condition = self.optimizeExpr(stmt.condition)
+        if isinstance(stmt.condition, Literal):
+            if isTruthy(stmt.condition.value):
+                return self.optimizeStmt(stmt.thenBranch)
+            if stmt.elseBranch is not None:
+                return self.optimizeStmt(stmt.elseBranch)
+            return None
+
+        stmt.thenBranch = self.optimizeBranch(stmt.thenBranch)
+        if stmt.elseBranch is not None:
+            stmt.elseBranch = self.optimizeBranch(stmt.elseBranch)
+        return stmt
+
+    def visitPrintStmt(self, stmt):
+        stmt.expression = self.optimizeExpr(stmt.expression)
+        return stmt
+
+    def visitReturnStmt(self, stmt):
+        if stmt.value is not None:
+            stmt.value = self.optimizeExpr(stmt.value)
+        return stmt
+
+    def visitVarStmt(self, stmt):
+        if stmt.initializer is not None:
+            stmt.initializer = self.optimizeExpr(stmt.initializer)
+            # Only locals know whether they are assigned, globals can be
+            # reassigned by any later line.
+            if isinstance(stmt.initializer, Literal) and not getattr(
+                stmt.name, "assigned", True
+            ):
+                self.constants[stmt.name] = stmt.initializer.value
+        return stmt
+
+    def visitWhileStmt(self, stmt):
+        stmt.condition = self.optimizeExpr(stmt.condition)
+        if isinstance(stmt.condition, Literal) and not isTruthy(
+            stmt.condition.value
+        ):
+            return None
+        stmt.body = self.optimizeBranch(stmt.body)
+        return stmt
+
+    def visitAssignmentExpr(self, expr):
+        expr.value = self.optimizeExpr(expr.value)
+        return expr
+
+    def visitBinaryExpr(self, expr):
+        expr.left = self.optimizeExpr(expr.left)
+        expr.right = self.optimizeExpr(expr.right)
+        if not isinstance(expr.left, Literal) or not isinstance(expr.right, Literal):
+            return expr
+
+        left = expr.left.value
+        right = expr.right.value
+        match expr.operator.type:
+            case TokenType.EQUAL_EQUAL:
+                return Literal(isEqual(left, right))
+            case TokenType.BANG_EQUAL:
+                return Literal(not isEqual(left, right))
+            case TokenType.PLUS if type(left) is str and type(right) is str:
+                return Literal(left + right)
+
+        if not loxNumber.isNumber(left) or not loxNumber.isNumber(right):
+            return expr
+        if expr.operator.type == TokenType.SLASH and right == 0:
+            return expr
+        return Literal(NUMBER_FOLDS[expr.operator.type](left, right))
+
+    def visitCallExpr(self, expr):
+        expr.callee = self.optimizeExpr(expr.callee)
+        self.optimizeArguments(expr.arguments)
+
+        function = self.inlineTarget(expr.callee)
+        if (
+            function is None
+            or len(expr.arguments) != len(function.params)
+            or not all(isSimple(argument) for argument in expr.arguments)
+        ):
+            return expr
+
+        self.stale = True
+        arguments = dict(zip(function.params, expr.arguments))
+        return self.optimizeExpr(substitute(function.body[0].value, arguments))
+
+    def visitInvokeExpr(self, expr):
+        expr.obj = self.optimizeExpr(expr.obj)
+        self.optimizeArguments(expr.arguments)
+        return expr
+
+    def visitSuperInvokeExpr(self, expr):
+        self.optimizeArguments(expr.arguments)
+        return expr
+
+    def visitGetExpr(self, expr):
+        expr.obj = self.optimizeExpr(expr.obj)
+        return expr
+
+    def visitGroupingExpr(self, expr):
+        expr.expr = self.optimizeExpr(expr.expr)
+        if isinstance(expr.expr, Literal):
+            return expr.expr
+        return expr
+
+    def visitLiteralExpr(self, expr):
+        return expr
+
+    def visitLogicalExpr(self, expr):
+        expr.left = self.optimizeExpr(expr.left)
+        expr.right = self.optimizeExpr(expr.right)
+        if not isinstance(expr.left, Literal):
+            return expr
+        # The left operand is the result when it decides the outcome,
+        # otherwise the right one is, whatever it evaluates to.
+        if isTruthy(expr.left.value) == (expr.operator.type == TokenType.OR):
+            return expr.left
+        return expr.right
+
+    def visitSetExpr(self, expr):
+        expr.obj = self.optimizeExpr(expr.obj)
+        expr.value = self.optimizeExpr(expr.value)
+        return expr
+
+    def visitSuperExpr(self, expr):
+        return expr
+
+    def visitThisExpr(self, expr):
+        return expr
+
+    def visitUnaryExpr(self, expr):
+        expr.right = self.optimizeExpr(expr.right)
+        if not isinstance(expr.right, Literal):
+            return expr
+
+        right = expr.right.value
+        if expr.operator.type == TokenType.BANG:
+            return Literal(not isTruthy(right))
+        if loxNumber.isNumber(right):
+            return Literal(-right)
+        return expr
+
+    def visitVariableExpr(self, expr):
+        declaration = getattr(expr, "declaration", None)
+        if declaration in self.constants:
+            return Literal(self.constants[declaration])
+        self.read(expr)
+        return expr
+
+    def read(self, expr):
+        declaration = getattr(expr, "declaration", None)
+        if declaration is not None:
+            self.reads.add(declaration)
+
+    def isUnused(self, stmt):
+        # Reads of a constant have all been replaced by its value.
+        return (
+            isinstance(stmt, Var)
+            and not getattr(stmt.name, "assigned", True)
+            and stmt.name not in self.reads
+            and isPure(stmt.initializer)
+        )
+
+    def isInlinable(self, function):
+        if len(function.body) != 1:
+            return False
+        statement = function.body[0]
+        if not isinstance(statement, Return) or statement.value is None:
+            return False
+        size = inlineSize(statement.value, function.params)
+        return size is not None and size <= INLINE_BUDGET
+
+    def inlineTarget(self, callee):
+        if not isinstance(callee, Variable):
+            return None
+        if hasattr(callee, "declaration"):
+            return self.functions.get(callee.declaration)
+        return self.globalFunctions.get(callee.name.lexeme)
+
+    def optimizeArguments(self, arguments):
+        for i, argument in enumerate(arguments):
+            arguments[i] = self.optimizeExpr(argument)
@@ -203,6 +203,12 @@ class Parser:
 
         paren = self.consume(TokenType.RIGHT_PAREN, "Expect ')' after arguments")
 
+        if isinstance(callee, Expr.Get):
+            # obj.method(...) is looked up and called in one step, so the
+            # method is only bound when its value is used some other way.
+            return Expr.Invoke(callee.obj, callee.name, paren, arguments)
+        if isinstance(callee, Expr.Super):
+            return Expr.SuperInvoke(callee.keyword, callee.method, paren, arguments)
         return Expr.Call(callee, paren, arguments)
 
     def primary(self):
@@ -0,0 +1,363 @@
+import hashlib
+import marshal
+import os
+import sys
+import time
+import weakref
+from types import CodeType
+from types import FunctionType
+from types import MethodType
+
+from codeGenerator import CodeGenerator
+from loxCallable import LoxCallable
+from token import Token
+from loxNumber import NUMBER_TYPES
+from loxNumber import MAX_EXACT
+from loxNumber import divide
+from rope import STRING_TYPES
+from rope import concatenate
+import loxValue
+
+# Bump when the generated code changes shape so stale cache entries are
+# not picked up.
+GENERATOR_VERSION = 5
+
+
+# What a loop moved into a helper function returns when it ends without
+# returning from the Lox function around it.
+NO_RETURN = object()
+
+
+def error(line, message):
+    return RuntimeError(Token(None, "", None, line), message)
+
+
+class LoxClassType(type):
+    def __str__(cls):
+        return cls.loxName
+
+
+class LoxObject(metaclass=LoxClassType):
+    loxName = None
+
+    def __str__(self):
+        return f"{type(self).loxName} instance"
+
+
+class Clock(LoxCallable):
+    def arity(self):
+        return 0
+
+    def call(self, interpreter, arguments):
+        return time.time()
+
+    def __str__(self):
+        return "<native fn>"
+
+
+def loxName(pyName):
+    return pyName.split("_", 1)[1]
+
+
+def stringify(object):
+    # Lox functions are plain Python functions here.
+    if type(object) is FunctionType:
+        return f"<fn {loxName(object.__name__)}>"
+    elif type(object) is MethodType:
+        return f"<fn {loxName(object.__func__.__name__)}>"
+    return loxValue.stringify(object)
+
+
+def add(a, b, line):
+    if type(a) is int and type(b) is int:
+        result = a + b
+        if -MAX_EXACT <= result <= MAX_EXACT:
+            return result
+        return float(result)
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return a + b
+    if type(a) in STRING_TYPES and type(b) in STRING_TYPES:
+        return concatenate(a, b)
+    raise error(line, "Operands must be two numbers or two strings.")
+
+
+def sub(a, b, line):
+    if type(a) is int and type(b) is int:
+        result = a - b
+        if -MAX_EXACT <= result <= MAX_EXACT:
+            return result
+        return float(result)
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return a - b
+    raise error(line, "Operand must be a number")
+
+
+def mul(a, b, line):
+    if type(a) is int and type(b) is int:
+        result = a * b
+        if -MAX_EXACT <= result <= MAX_EXACT:
+            return result
+        return float(result)
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return a * b
+    raise error(line, "Operand must be a number")
+
+
+def div(a, b, line):
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return divide(a, b)
+    raise error(line, "Operand must be a number")
+
+
+def gt(a, b, line):
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return a > b
+    raise error(line, "Operand must be a number")
+
+
+def ge(a, b, line):
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return a >= b
+    raise error(line, "Operand must be a number")
+
+
+def lt(a, b, line):
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return a < b
+    raise error(line, "Operand must be a number")
+
+
+def le(a, b, line):
+    if type(a) in NUMBER_TYPES and type(b) in NUMBER_TYPES:
+        return a <= b
+    raise error(line, "Operand must be a number")
+
+
+def neg(a, line):
+    if type(a) in NUMBER_TYPES:
+        return -a
+    raise error(line, "Operand must be a number")
+
+
+def call(callee, line, *arguments):
+    kind = type(callee)
+    if kind is FunctionType:
+        arity = callee.__code__.co_argcount
+    elif kind is MethodType:
+        arity = callee.__func__.__code__.co_argcount - 1
+    elif kind is LoxClassType:
+        instance = callee.__new__(callee)
+        initializer = getattr(callee, "f_init", None)
+        if initializer is None:
+            arity = 0
+            callee = None
+        else:
+            arity = initializer.__code__.co_argcount - 1
+            callee = MethodType(initializer, instance)
+        if len(arguments) != arity:
+            raise error(line, f"Expected {arity} arguments but got {len(arguments)}.")
+        if callee is not None:
+            callee(*arguments)
+        return instance
+    elif isinstance(callee, LoxCallable):
+        if len(arguments) != callee.arity():
+            raise error(
+                line, f"Expected {callee.arity()} arguments but got {len(arguments)}."
+            )
+        return callee.call(None, list(arguments))
+    else:
+        raise error(line, "Can only call functions and classes.")
+
+    if len(arguments) != arity:
+        raise error(line, f"Expected {arity} arguments but got {len(arguments)}.")
+    return callee(*arguments)
+
+
+def get(obj, name, line):
+    if not isinstance(obj, LoxObject):
+        raise error(line, "Only instances have properties.")
+    try:
+        return getattr(obj, name)
+    except AttributeError:
+        raise error(line, f"Undefined property '{loxName(name)}'.")
+
+
+def instance(obj, line):
+    if not isinstance(obj, LoxObject):
+        raise error(line, "Only instances have fields.")
+    return obj
+
+
+def set(obj, name, value):
+    setattr(obj, name, value)
+    return value
+
+
+def superMethod(superclass, name, this, line):
+    method = getattr(superclass, name, None)
+    if method is None:
+        raise error(line, f"Undefinied property '{loxName(name)}'.")
+    return MethodType(method, this)
+
+
+def superclass(value, line):
+    if not isinstance(value, LoxClassType):
+        raise error(line, "Superclass must be a class.")
+    return value
+
+
+def checked(globals, name, value, line):
+    if name not in globals:
+        raise error(line, f"Undefined variable {loxName(name)}.")
+    return value
+
+
+def undefined(name, line):
+    raise error(line, f"Undefined variable {name}.")
+
+
+def setBox(box, value):
+    box[0] = value
+    return value
+
+
+class PythonBackend:
+    # Runs programs by translating them to Python with CodeGenerator. The
+    # compiled code object and its line map are cached on disk, keyed by a
+    # hash of the Lox source, so unchanged scripts skip the whole front end.
+    def __init__(self, errorHandler, cacheDir=None):
+        self.errorHandler = errorHandler
+        if cacheDir is None:
+            cacheDir = os.environ.get(
+                "PYLOX_CACHE_DIR",
+                os.path.join(os.path.expanduser("~"), ".cache", "pylox"),
+            )
+        self.cacheDir = cacheDir
+        # Line maps by the file name of the code they belong to, and how
+        # many of those code objects can still run.
+        self.lineMaps = {}
+        self.liveCode = {}
+        self.namespace = {
+            "_add": add,
+            "_sub": sub,
+            "_mul": mul,
+            "_div": div,
+            "_gt": gt,
+            "_ge": ge,
+            "_lt": lt,
+            "_le": le,
+            "_neg": neg,
+            "_call": call,
+            "_get": get,
+            "_instance": instance,
+            "_set": set,
+            "_super": superMethod,
+            "_superclass": superclass,
+            "_checked": checked,
+            "_undefined": undefined,
+            "_setBox": setBox,
+            "_noReturn": NO_RETURN,
+            "_stringify": stringify,
+            "_LoxObject": LoxObject,
+            "g_clock": Clock(),
+        }
+        self.namespace["_G"] = self.namespace
+
+    def key(self, source, wholeProgram, optimize):
+        # Whole programs are optimized further, and the optimizer can be
+        # turned off, see Lox.run.
+        digest = hashlib.sha256(source.encode("utf-8"))
+        options = f"{GENERATOR_VERSION}:{wholeProgram}:{optimize}:{sys.version}"
+        digest.update(options.encode("utf-8"))
+        return digest.hexdigest()
+
+    def cachePath(self, key):
+        return os.path.join(self.cacheDir, f"{key}.loxc")
+
+    def load(self, source, wholeProgram=False, optimize=True):
+        key = self.key(source, wholeProgram, optimize)
+        try:
+            with open(self.cachePath(key), "rb") as f:
+                code, lineMap = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return key, code, lineMap
+
+    def compile(self, source, statements, wholeProgram=False, optimize=True):
+        # Returns None for programs nested deeper than Python can compile
+        # even with the generator's helper functions, such as ifs past its
+        # indentation limit.
+        key = self.key(source, wholeProgram, optimize)
+        try:
+            pySource, lineMap = CodeGenerator().generate(statements)
+            code = compile(pySource, f"<pylox {key}>", "exec")
+        except (SyntaxError, RecursionError):
+            return None
+        lineMap = tuple(lineMap)
+
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            path = self.cachePath(key)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                marshal.dump((code, lineMap), f)
+            os.replace(temporary, path)
+        except OSError:
+            pass
+
+        return key, code, lineMap
+
+    def execute(self, program):
+        key, code, lineMap = program
+        self.lineMaps[code.co_filename] = lineMap
+        self.track(code)
+        try:
+            exec(code, self.namespace)
+            self.namespace.pop("_main")()
+        except RecursionError as exception:
+            self.errorHandler.runtimeError(
+                error(self.loxLine(exception), "Stack overflow.")
+            )
+        except RuntimeError as exception:
+            self.errorHandler.runtimeError(exception)
+        except NameError as exception:
+            self.errorHandler.runtimeError(
+                error(
+                    self.loxLine(exception),
+                    f"Undefined variable {loxName(exception.name)}.",
+                )
+            )
+        except AttributeError as exception:
+            self.errorHandler.runtimeError(
+                error(
+                    self.loxLine(exception),
+                    f"Undefined property '{loxName(exception.name)}'.",
+                )
+            )
+
+    def track(self, code):
+        # A line's map is dropped once none of its code can run any more, so
+        # a long REPL session only keeps the maps of functions still around.
+        filename = code.co_filename
+        codes = [code]
+        for nested in codes:
+            codes.extend(c for c in nested.co_consts if type(c) is CodeType)
+        self.liveCode[filename] = self.liveCode.get(filename, 0) + len(codes)
+        for nested in codes:
+            weakref.finalize(nested, self.release, filename)
+
+    def release(self, filename):
+        self.liveCode[filename] -= 1
+        if self.liveCode[filename] == 0:
+            del self.liveCode[filename]
+            del self.lineMaps[filename]
+
+    def loxLine(self, exception):
+        line = 0
+        traceback = exception.__traceback__
+        while traceback is not None:
+            lineMap = self.lineMaps.get(traceback.tb_frame.f_code.co_filename)
+            if lineMap is not None:
+                line = lineMap[traceback.tb_lineno - 1]
+            traceback = traceback.tb_next
+        return line
@@ -3,7 +3,11 @@ from StmtVisitor import StmtVisitor
 from enum import Enum
 from enum import auto
 
+from Expr import Call
+from Expr import Invoke
+from Expr import SuperInvoke
 from LoxInstance import LoxInstance
+from environment import UPVALUE
 
 
 class FunctionType(Enum):
@@ -19,24 +23,55 @@ class ClassType(Enum):
     SUBCLASS = auto()
 
 
+class LocalSlot:
+    def __init__(self, index, name=None, isDeclaration=False):
+        self.index = index
+        self.name = name
+        self.isDeclaration = isDeclaration
+        self.defined = False
+        self.captured = False
+        self.assigned = False
+        self.references = []
+
+    def boxed(self):
+        # Captures that can't change once the closure exists are copied into
+        # it, the rest share a Cell with the declaring scope. Functions and
+        # classes capture themselves before they are defined.
+        return self.captured and (self.assigned or self.isDeclaration)
+
+
+class FunctionScope:
+    def __init__(self, scopeStart):
+        self.scopeStart = scopeStart
+        self.upvalues = []
+        self.upvalueIndexes = {}
+
+
 class Resolver(ExprVisitor, StmtVisitor):
     def __init__(self, interpreter, errorHandler):
         self.interpreter = interpreter
         self.errorHandler = errorHandler
         self.scopes = []
+        self.functions = [FunctionScope(0)]
+        self.slots = []
+        self.closures = []
+        self.globalAssignments = set()
         self.currentFunction = FunctionType.NONE
         self.currentClass = ClassType.NONE
 
     def visitBlockStmt(self, stmt):
         self.beginScope()
         self.resolve(stmt.statements)
+        # A block that declares nothing runs in the enclosing Environment
+        # and doesn't count towards any distance.
+        self.interpreter.resolveBlock(stmt, len(self.scopes[-1]) == 0)
         self.endScope()
         return None
 
     def visitClassStmt(self, stmt):
         enclosingClass = self.currentClass
         self.currentClass = ClassType.CLASS
-        self.declare(stmt.name)
+        self.declare(stmt.name, True)
         self.define(stmt.name)
 
         if (
@@ -51,10 +86,7 @@ class Resolver(ExprVisitor, StmtVisitor):
             self.currentClass = ClassType.SUBCLASS
             self.resolve(stmt.superclass)
             self.beginScope()
-            self.scopes[-1]["super"] = True
-
-        self.beginScope()
-        self.scopes[-1]["this"] = True
+            self.defineSlot("super")
 
         for method in stmt.methods:
             declaration = FunctionType.METHOD
@@ -62,8 +94,6 @@ class Resolver(ExprVisitor, StmtVisitor):
                 declaration = FunctionType.INITIALIZER
             self.resolveFunction(method, declaration)
 
-        self.endScope()
-
         if stmt.superclass is not None:
             self.endScope()
 
@@ -92,12 +122,16 @@ class Resolver(ExprVisitor, StmtVisitor):
                 stmt.keyword.line, "Can't return from top-level code."
             )
 
+        isTailCall = False
         if stmt.value is not None:
             if self.currentFunction == FunctionType.INITIALIZER:
                 self.errorHandler.error(
                     stmt.keyword.line, "Can't return a value from an initializer."
                 )
+            else:
+                isTailCall = isinstance(stmt.value, (Call, Invoke, SuperInvoke))
             self.resolve(stmt.value)
+        self.interpreter.resolveReturn(stmt, isTailCall)
         return None
 
     def visitWhileStmt(self, stmt):
@@ -106,7 +140,7 @@ class Resolver(ExprVisitor, StmtVisitor):
         return None
 
     def visitFunctionStmt(self, stmt):
-        self.declare(stmt.name)
+        self.declare(stmt.name, True)
         self.define(stmt.name)
 
         self.resolveFunction(stmt, FunctionType.FUNCTION)
@@ -122,11 +156,15 @@ class Resolver(ExprVisitor, StmtVisitor):
 
     def visitAssignmentExpr(self, expr):
         self.resolve(expr.value)
-        self.resolveLocal(expr, expr.name)
+        self.resolveLocal(expr, expr.name, True)
         return None
 
     def visitVariableExpr(self, expr):
-        if not len(self.scopes) == 0 and self.scopes[-1].get(expr.name.lexeme) == False:
+        if (
+            not len(self.scopes) == 0
+            and expr.name.lexeme in self.scopes[-1]
+            and not self.scopes[-1][expr.name.lexeme].defined
+        ):
             self.errorHandler.error(
                 expr.name, "Can't read local variable in its own initializer."
             )
@@ -145,6 +183,13 @@ class Resolver(ExprVisitor, StmtVisitor):
             self.resolve(argument)
         return None
 
+    def visitInvokeExpr(self, expr):
+        self.resolve(expr.obj)
+
+        for argument in expr.arguments:
+            self.resolve(argument)
+        return None
+
     def visitGetExpr(self, expr):
         self.resolve(expr.obj)
         return None
@@ -157,6 +202,7 @@ class Resolver(ExprVisitor, StmtVisitor):
         return None
 
     def visitLogicalExpr(self, expr):
+        self.resolve(expr.left)
         self.resolve(expr.right)
         return None
 
@@ -165,6 +211,13 @@ class Resolver(ExprVisitor, StmtVisitor):
         self.resolve(expr.obj)
         return None
 
+    def visitSuperInvokeExpr(self, expr):
+        self.visitSuperExpr(expr)
+
+        for argument in expr.arguments:
+            self.resolve(argument)
+        return None
+
     def visitSuperExpr(self, expr):
         if self.currentClass == ClassType.NONE:
             self.errorHandler.error(
@@ -175,6 +228,9 @@ class Resolver(ExprVisitor, StmtVisitor):
                 expr.keyword.line, "Can't use 'super' in a class with no superclass."
             )
         self.resolveLocal(expr, expr.keyword)
+        # The instance is found through the keyword token, the node itself
+        # resolves to the superclass.
+        self.resolveName(expr.keyword, "this")
         return None
 
     def visitThisExpr(self, expr):
@@ -200,11 +256,15 @@ class Resolver(ExprVisitor, StmtVisitor):
     def resolveFunction(self, function, type):
         enclosingFunction = self.currentFunction
         self.currentFunction = type
+        self.functions.append(FunctionScope(len(self.scopes)))
         self.beginScope()
+        if type == FunctionType.METHOD or type == FunctionType.INITIALIZER:
+            self.defineSlot("this")
         for param in function.params:
             self.declare(param)
             self.define(param)
         self.resolve(function.body)
+        self.closures.append((function, self.functions.pop(), self.scopes[-1]))
         self.endScope()
         self.currentFunction = enclosingFunction
 
@@ -213,9 +273,47 @@ class Resolver(ExprVisitor, StmtVisitor):
 
     def endScope(self):
         self.scopes.pop()
+        if len(self.scopes) == 0:
+            self.report()
+
+    def report(self):
+        # Whether a slot needs a Cell, and which blocks are empty, is only
+        # known once the outermost scope is done, so everything inside it is
+        # reported to the interpreter here.
+        for slot in self.slots:
+            boxed = slot.boxed()
+            if slot.name is not None:
+                self.interpreter.resolveDeclaration(slot.name, boxed, slot.assigned)
+            for key, between, index in slot.references:
+                self.interpreter.resolve(
+                    key, self.distance(between), index, boxed, slot.name
+                )
 
-    def declare(self, name):
+        for function, functionScope, scope in self.closures:
+            cells = tuple(
+                scope[param.lexeme].index
+                for param in function.params
+                if scope[param.lexeme].boxed()
+            )
+            upvalues = tuple(
+                (self.distance(between), index)
+                for between, index in functionScope.upvalues
+            )
+            self.interpreter.resolveFunction(function, upvalues, cells)
+
+        self.slots = []
+        self.closures = []
+
+    def distance(self, between):
+        if between == UPVALUE:
+            return UPVALUE
+        return sum(1 for scope in between if len(scope) > 0)
+
+    def declare(self, name, isDeclaration=False):
         if len(self.scopes) == 0:
+            # Globals can be assigned from any later line, so they are never
+            # taken to be constant.
+            self.interpreter.resolveDeclaration(name, False, True)
             return None
 
         scope = self.scopes[-1]
@@ -223,15 +321,59 @@ class Resolver(ExprVisitor, StmtVisitor):
             self.errorHandler.error(
                 name, "Already variable with this name in this scope"
             )
-        scope[name.lexeme] = False
+            return None
+        scope[name.lexeme] = LocalSlot(len(scope), name, isDeclaration)
+        self.slots.append(scope[name.lexeme])
 
     def define(self, name):
         if len(self.scopes) == 0:
             return None
-        self.scopes[-1][name.lexeme] = True
+        self.scopes[-1][name.lexeme].defined = True
+
+    def defineSlot(self, lexeme):
+        slot = LocalSlot(len(self.scopes[-1]))
+        slot.defined = True
+        self.scopes[-1][lexeme] = slot
+        self.slots.append(slot)
+
+    def resolveLocal(self, expr, name, assigned=False):
+        self.resolveName(expr, name.lexeme, assigned)
+
+    def resolveName(self, key, lexeme, assigned=False):
+        found = self.lookUp(lexeme, len(self.functions) - 1)
+        if found is None:
+            if assigned:
+                self.globalAssignments.add(lexeme)
+            return None
+        between, index, slot = found
+        if assigned:
+            slot.assigned = True
+        slot.references.append((key, between, index))
+
+    def lookUp(self, lexeme, level):
+        # Locals of the function at level are found with the scopes between
+        # the reference and the declaration, which give the distance once
+        # it's known which of them are empty. Variables of enclosing
+        # functions become upvalues, added to every function in between.
+        function = self.functions[level]
+        end = len(self.scopes)
+        if level + 1 < len(self.functions):
+            end = self.functions[level + 1].scopeStart
+
+        for i in range(end - 1, function.scopeStart - 1, -1):
+            slot = self.scopes[i].get(lexeme)
+            if slot is not None:
+                return self.scopes[i + 1 : end], slot.index, slot
+
+        if level == 0:
+            return None
+        found = self.lookUp(lexeme, level - 1)
+        if found is None:
+            return None
 
-    def resolveLocal(self, expr, name):
-        for i, scope in enumerate(reversed(self.scopes)):
-            if name.lexeme in scope:
-                self.interpreter.resolve(expr, i)
-                return None
+        between, index, slot = found
+        slot.captured = True
+        if slot not in function.upvalueIndexes:
+            function.upvalueIndexes[slot] = len(function.upvalues)
+            function.upvalues.append((between, index))
+        return UPVALUE, function.upvalueIndexes[slot], slot
@@ -0,0 +1,61 @@
+# Concatenations shorter than this are copied into a plain str, a Rope only
+# pays off once copying the text costs more than the extra object.
+MIN_ROPE_LENGTH = 128
+
+
+class Rope:
+    # A Lox string built with +, kept as its two halves until its text is
+    # needed. Appending to a long string in a loop then doesn't copy
+    # everything built so far on every step. The text is joined once, the
+    # first time the string is printed or compared, and kept from then on.
+    __slots__ = ("left", "right", "length", "text")
+
+    def __init__(self, left, right, length):
+        self.left = left
+        self.right = right
+        self.length = length
+        self.text = None
+
+    def flatten(self):
+        if self.text is None:
+            # Ropes built in a loop are as deep as the loop is long, so they
+            # are walked with a stack rather than recursion.
+            pieces = []
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if type(node) is str:
+                    pieces.append(node)
+                elif node.text is not None:
+                    pieces.append(node.text)
+                else:
+                    stack.append(node.right)
+                    stack.append(node.left)
+            self.text = "".join(pieces)
+            self.left = None
+            self.right = None
+        return self.text
+
+    def __len__(self):
+        return self.length
+
+    def __eq__(self, other):
+        if type(other) is Rope:
+            other = other.flatten()
+        return self.flatten() == other
+
+    def __hash__(self):
+        return hash(self.flatten())
+
+    def __str__(self):
+        return self.flatten()
+
+
+STRING_TYPES = (str, Rope)
+
+
+def concatenate(a, b):
+    length = len(a) + len(b)
+    if length < MIN_ROPE_LENGTH:
+        return a + b
+    return Rope(a, b, length)
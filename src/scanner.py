@@ -1,5 +1,7 @@
+from sys import intern
 from token import TokenType
 from token import Token
+from loxNumber import number
 
 
 class Scanner:
@@ -155,7 +157,7 @@ class Scanner:
         # Closing
         self.advance()
 
-        value = self.source[self.start + 1 : self.current - 1]
+        value = intern(self.source[self.start + 1 : self.current - 1])
         self.addToken(TokenType.STRING, literal=value)
 
     def number(self):
@@ -168,21 +170,24 @@ class Scanner:
         while self.peek().isdigit():
             self.advance()
 
-        value = float(self.source[self.start : self.current])
+        value = number(self.source[self.start : self.current])
         self.addToken(TokenType.NUMBER, literal=value)
 
     def identifier(self):
         while self.peek().isalnum() or self.peek() == "_":
             self.advance()
 
-        text = self.source[self.start : self.current]
+        # Names are interned, so every occurrence of one shares a single str
+        # and the dicts keyed by names find it by identity.
+        text = intern(self.source[self.start : self.current])
         if text in self.keywords:
             tokenType = self.keywords[text]
         else:
             tokenType = TokenType.IDENTIFIER
 
-        self.addToken(tokenType)
+        self.addToken(tokenType, lexeme=text)
 
-    def addToken(self, type, literal=None):
-        text = self.source[self.start : self.current]
-        self.tokens.append(Token(type, text, literal, self.line))
+    def addToken(self, type, literal=None, lexeme=None):
+        if lexeme is None:
+            lexeme = self.source[self.start : self.current]
+        self.tokens.append(Token(type, lexeme, literal, self.line))
@@ -0,0 +1,20 @@
+from Expr import Literal
+from Expr import This
+from Expr import Variable
+
+
+# What the optimizer and the compilers may assume about evaluating an
+# expression, for expressions that have been resolved.
+def isPure(expr):
+    # Reading a global fails when it isn't defined, locals are always there.
+    if expr is None or isinstance(expr, (Literal, This)):
+        return True
+    return isinstance(expr, Variable) and hasattr(expr, "resolved")
+
+
+def isSimple(expr):
+    # Arguments that can be read any number of times, or not at all, without
+    # anyone noticing.
+    return isinstance(expr, (Literal, This)) or (
+        isinstance(expr, Variable) and hasattr(expr, "resolved")
+    )
@@ -0,0 +1,544 @@
+import time
+
+from chunk import OpCode
+from token import Token
+from loxNumber import NUMBER_TYPES
+from loxNumber import MAX_EXACT
+from loxNumber import divide
+from rope import STRING_TYPES
+from rope import concatenate
+from loxValue import stringify
+
+CONSTANT = OpCode.CONSTANT.value
+NIL = OpCode.NIL.value
+TRUE = OpCode.TRUE.value
+FALSE = OpCode.FALSE.value
+POP = OpCode.POP.value
+GET_LOCAL = OpCode.GET_LOCAL.value
+SET_LOCAL = OpCode.SET_LOCAL.value
+GET_GLOBAL = OpCode.GET_GLOBAL.value
+DEFINE_GLOBAL = OpCode.DEFINE_GLOBAL.value
+SET_GLOBAL = OpCode.SET_GLOBAL.value
+GET_UPVALUE = OpCode.GET_UPVALUE.value
+SET_UPVALUE = OpCode.SET_UPVALUE.value
+GET_PROPERTY = OpCode.GET_PROPERTY.value
+SET_PROPERTY = OpCode.SET_PROPERTY.value
+GET_SUPER = OpCode.GET_SUPER.value
+CHECK_PROPERTY = OpCode.CHECK_PROPERTY.value
+CHECK_SUPER = OpCode.CHECK_SUPER.value
+EQUAL = OpCode.EQUAL.value
+NOT_EQUAL = OpCode.NOT_EQUAL.value
+GREATER = OpCode.GREATER.value
+GREATER_EQUAL = OpCode.GREATER_EQUAL.value
+LESS = OpCode.LESS.value
+LESS_EQUAL = OpCode.LESS_EQUAL.value
+ADD = OpCode.ADD.value
+SUBTRACT = OpCode.SUBTRACT.value
+MULTIPLY = OpCode.MULTIPLY.value
+DIVIDE = OpCode.DIVIDE.value
+NOT = OpCode.NOT.value
+NEGATE = OpCode.NEGATE.value
+PRINT = OpCode.PRINT.value
+JUMP = OpCode.JUMP.value
+JUMP_IF_FALSE = OpCode.JUMP_IF_FALSE.value
+LOOP = OpCode.LOOP.value
+CALL = OpCode.CALL.value
+INVOKE = OpCode.INVOKE.value
+SUPER_INVOKE = OpCode.SUPER_INVOKE.value
+CLOSURE = OpCode.CLOSURE.value
+CLOSE_UPVALUE = OpCode.CLOSE_UPVALUE.value
+RETURN = OpCode.RETURN.value
+CLASS = OpCode.CLASS.value
+INHERIT = OpCode.INHERIT.value
+METHOD = OpCode.METHOD.value
+
+# Deepest Lox call stack a VM allows. Frames live on the heap, so this only
+# bounds memory; going past it is reported as a Lox runtime error.
+FRAMES_MAX = 100000
+
+
+class Upvalue:
+    # While open, cell is the VM stack and index the captured slot. Closing
+    # moves the value into a private one element list, so reads and writes
+    # are cell[index] in both states.
+    __slots__ = ("cell", "index")
+
+    def __init__(self, stack, index):
+        self.cell = stack
+        self.index = index
+
+    def close(self):
+        self.cell = [self.cell[self.index]]
+        self.index = 0
+
+
+class Closure:
+    __slots__ = ("function", "upvalues")
+
+    def __init__(self, function, upvalues):
+        self.function = function
+        self.upvalues = upvalues
+
+    def __str__(self):
+        return str(self.function)
+
+
+class NativeFunction:
+    def __init__(self, arity, function):
+        self.arity = arity
+        self.function = function
+
+    def __str__(self):
+        return "<native fn>"
+
+
+class VMClass:
+    def __init__(self, name):
+        self.name = name
+        self.methods = {}
+
+    def __str__(self):
+        return self.name
+
+
+class VMInstance:
+    __slots__ = ("klass", "fields")
+
+    def __init__(self, klass):
+        self.klass = klass
+        self.fields = {}
+
+    def __str__(self):
+        return f"{self.klass.name} instance"
+
+
+class BoundMethod:
+    __slots__ = ("receiver", "method")
+
+    def __init__(self, receiver, method):
+        self.receiver = receiver
+        self.method = method
+
+    def __str__(self):
+        return str(self.method)
+
+
+class CallFrame:
+    __slots__ = ("closure", "ip", "base")
+
+    def __init__(self, closure, ip, base):
+        self.closure = closure
+        self.ip = ip
+        self.base = base
+
+
+class VM:
+    def __init__(self, errorHandler, framesMax=FRAMES_MAX):
+        self.errorHandler = errorHandler
+        self.framesMax = framesMax
+        self.globals = {}
+        self.stack = []
+        self.frames = []
+        self.openUpvalues = {}
+
+        self.globals["clock"] = NativeFunction(0, time.time)
+
+    def interpret(self, function):
+        closure = Closure(function, [])
+        self.stack.append(closure)
+        self.frames.append(CallFrame(closure, 0, 0))
+        try:
+            self.run()
+        except RuntimeError as error:
+            self.errorHandler.runtimeError(error)
+            self.stack.clear()
+            self.frames.clear()
+            self.openUpvalues.clear()
+
+    def captureUpvalue(self, index):
+        upvalue = self.openUpvalues.get(index)
+        if upvalue is None:
+            upvalue = Upvalue(self.stack, index)
+            self.openUpvalues[index] = upvalue
+        return upvalue
+
+    def closeUpvalues(self, last):
+        for index in [index for index in self.openUpvalues if index >= last]:
+            self.openUpvalues.pop(index).close()
+
+    def error(self, line, message):
+        return RuntimeError(Token(None, "", None, line), message)
+
+    def run(self):
+        stack = self.stack
+        frames = self.frames
+        globals = self.globals
+        push = stack.append
+        pop = stack.pop
+        framesMax = self.framesMax
+        numberTypes = NUMBER_TYPES
+        maxExact = MAX_EXACT
+        minExact = -MAX_EXACT
+
+        frame = frames[-1]
+        closure = frame.closure
+        chunk = closure.function.chunk
+        code = chunk.code
+        lines = chunk.lines
+        constants = chunk.constants
+        ip = frame.ip
+        base = frame.base
+
+        while True:
+            op = code[ip]
+            ip += 1
+
+            if op == GET_LOCAL:
+                push(stack[base + code[ip]])
+                ip += 1
+
+            elif op == CONSTANT:
+                push(constants[code[ip]])
+                ip += 1
+
+            elif op == GET_GLOBAL:
+                name = constants[code[ip]]
+                ip += 1
+                try:
+                    push(globals[name])
+                except KeyError:
+                    raise self.error(lines[ip - 1], f"Undefined variable {name}.")
+
+            elif op == SET_LOCAL:
+                stack[base + code[ip]] = stack[-1]
+                ip += 1
+
+            elif op == POP:
+                pop()
+
+            elif op == JUMP_IF_FALSE:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip += code[ip]
+                ip += 1
+
+            elif op == LOOP:
+                ip -= code[ip] - 1
+
+            elif op == JUMP:
+                ip += code[ip] + 1
+
+            elif op == ADD:
+                b = pop()
+                a = stack[-1]
+                if type(a) is int and type(b) is int:
+                    result = a + b
+                    if not minExact <= result <= maxExact:
+                        result = float(result)
+                    stack[-1] = result
+                elif type(a) in numberTypes and type(b) in numberTypes:
+                    stack[-1] = a + b
+                elif type(a) in STRING_TYPES and type(b) in STRING_TYPES:
+                    stack[-1] = concatenate(a, b)
+                else:
+                    raise self.error(
+                        lines[ip - 1], "Operands must be two numbers or two strings."
+                    )
+
+            elif op == SUBTRACT:
+                b = pop()
+                a = stack[-1]
+                if type(a) is int and type(b) is int:
+                    result = a - b
+                    if not minExact <= result <= maxExact:
+                        result = float(result)
+                    stack[-1] = result
+                elif type(a) in numberTypes and type(b) in numberTypes:
+                    stack[-1] = a - b
+                else:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+
+            elif op == MULTIPLY:
+                b = pop()
+                a = stack[-1]
+                if type(a) is int and type(b) is int:
+                    result = a * b
+                    if not minExact <= result <= maxExact:
+                        result = float(result)
+                    stack[-1] = result
+                elif type(a) in numberTypes and type(b) in numberTypes:
+                    stack[-1] = a * b
+                else:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+
+            elif op == DIVIDE:
+                b = pop()
+                a = stack[-1]
+                if type(a) not in numberTypes or type(b) not in numberTypes:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+                stack[-1] = divide(a, b)
+
+            elif op == LESS:
+                b = pop()
+                a = stack[-1]
+                if type(a) not in numberTypes or type(b) not in numberTypes:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+                stack[-1] = a < b
+
+            elif op == LESS_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) not in numberTypes or type(b) not in numberTypes:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+                stack[-1] = a <= b
+
+            elif op == GREATER:
+                b = pop()
+                a = stack[-1]
+                if type(a) not in numberTypes or type(b) not in numberTypes:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+                stack[-1] = a > b
+
+            elif op == GREATER_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) not in numberTypes or type(b) not in numberTypes:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+                stack[-1] = a >= b
+
+            elif op == EQUAL:
+                b = pop()
+                stack[-1] = stack[-1] == b
+
+            elif op == NOT_EQUAL:
+                b = pop()
+                stack[-1] = stack[-1] != b
+
+            elif op == GET_UPVALUE:
+                upvalue = closure.upvalues[code[ip]]
+                ip += 1
+                push(upvalue.cell[upvalue.index])
+
+            elif op == SET_UPVALUE:
+                upvalue = closure.upvalues[code[ip]]
+                ip += 1
+                upvalue.cell[upvalue.index] = stack[-1]
+
+            elif op == CALL or op == INVOKE or op == SUPER_INVOKE:
+                if op == CALL:
+                    argCount = code[ip]
+                    ip += 1
+                    callee = stack[-1 - argCount]
+                else:
+                    name = constants[code[ip]]
+                    argCount = code[ip + 1]
+                    ip += 2
+                    if op == SUPER_INVOKE:
+                        superclass = pop()
+                        callee = superclass.methods.get(name)
+                        if callee is None:
+                            raise self.error(
+                                lines[ip - 1], f"Undefinied property '{name}'."
+                            )
+                    else:
+                        receiver = stack[-1 - argCount]
+                        if not isinstance(receiver, VMInstance):
+                            raise self.error(
+                                lines[ip - 1], "Only instances have properties."
+                            )
+                        callee = receiver.fields.get(name)
+                        if callee is not None or name in receiver.fields:
+                            stack[-1 - argCount] = callee
+                        else:
+                            callee = receiver.klass.methods.get(name)
+                            if callee is None:
+                                raise self.error(
+                                    lines[ip - 1], f"Undefined property '{name}'."
+                                )
+
+                if type(callee) is BoundMethod:
+                    stack[-1 - argCount] = callee.receiver
+                    callee = callee.method
+                elif type(callee) is VMClass:
+                    klass = callee
+                    stack[-1 - argCount] = VMInstance(klass)
+                    callee = klass.methods.get("init")
+                    if callee is None:
+                        if argCount != 0:
+                            raise self.error(
+                                lines[ip - 1],
+                                f"Expected 0 arguments but got {argCount}.",
+                            )
+                        continue
+                elif type(callee) is NativeFunction:
+                    if argCount != callee.arity:
+                        raise self.error(
+                            lines[ip - 1],
+                            f"Expected {callee.arity} arguments but got {argCount}.",
+                        )
+                    arguments = stack[len(stack) - argCount :]
+                    del stack[len(stack) - argCount - 1 :]
+                    push(callee.function(*arguments))
+                    continue
+
+                if type(callee) is not Closure:
+                    raise self.error(
+                        lines[ip - 1], "Can only call functions and classes."
+                    )
+
+                function = callee.function
+                if argCount != function.arity:
+                    raise self.error(
+                        lines[ip - 1],
+                        f"Expected {function.arity} arguments but got {argCount}.",
+                    )
+
+                if len(frames) == framesMax:
+                    raise self.error(lines[ip - 1], "Stack overflow.")
+
+                frame.ip = ip
+                frame = CallFrame(callee, 0, len(stack) - argCount - 1)
+                frames.append(frame)
+                closure = callee
+                chunk = function.chunk
+                code = chunk.code
+                lines = chunk.lines
+                constants = chunk.constants
+                ip = 0
+                base = frame.base
+
+            elif op == RETURN:
+                result = pop()
+                if self.openUpvalues:
+                    self.closeUpvalues(base)
+                frames.pop()
+                del stack[base:]
+                if not frames:
+                    return
+                push(result)
+
+                frame = frames[-1]
+                closure = frame.closure
+                chunk = closure.function.chunk
+                code = chunk.code
+                lines = chunk.lines
+                constants = chunk.constants
+                ip = frame.ip
+                base = frame.base
+
+            elif op == SET_GLOBAL:
+                name = constants[code[ip]]
+                ip += 1
+                if name not in globals:
+                    raise self.error(lines[ip - 1], f"Undefined variable {name}.")
+                globals[name] = stack[-1]
+
+            elif op == GET_PROPERTY:
+                instance = stack[-1]
+                name = constants[code[ip]]
+                ip += 1
+                if not isinstance(instance, VMInstance):
+                    raise self.error(lines[ip - 1], "Only instances have properties.")
+                if name in instance.fields:
+                    stack[-1] = instance.fields[name]
+                else:
+                    method = instance.klass.methods.get(name)
+                    if method is None:
+                        raise self.error(
+                            lines[ip - 1], f"Undefined property '{name}'."
+                        )
+                    stack[-1] = BoundMethod(instance, method)
+
+            elif op == SET_PROPERTY:
+                value = pop()
+                instance = stack[-1]
+                name = constants[code[ip]]
+                ip += 1
+                if not isinstance(instance, VMInstance):
+                    raise self.error(lines[ip - 1], "Only instances have fields.")
+                instance.fields[name] = value
+                stack[-1] = value
+
+            elif op == NIL:
+                push(None)
+
+            elif op == TRUE:
+                push(True)
+
+            elif op == FALSE:
+                push(False)
+
+            elif op == NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+
+            elif op == NEGATE:
+                value = stack[-1]
+                if type(value) not in numberTypes:
+                    raise self.error(lines[ip - 1], "Operand must be a number")
+                stack[-1] = -value
+
+            elif op == PRINT:
+                print(stringify(pop()))
+
+            elif op == DEFINE_GLOBAL:
+                globals[constants[code[ip]]] = pop()
+                ip += 1
+
+            elif op == CLOSURE:
+                function = constants[code[ip]]
+                ip += 1
+                upvalues = []
+                for _ in range(function.upvalueCount):
+                    isLocal = code[ip]
+                    index = code[ip + 1]
+                    ip += 2
+                    if isLocal:
+                        upvalues.append(self.captureUpvalue(base + index))
+                    else:
+                        upvalues.append(closure.upvalues[index])
+                push(Closure(function, upvalues))
+
+            elif op == CLOSE_UPVALUE:
+                self.closeUpvalues(len(stack) - 1)
+                pop()
+
+            elif op == GET_SUPER:
+                name = constants[code[ip]]
+                ip += 1
+                superclass = pop()
+                method = superclass.methods.get(name)
+                if method is None:
+                    raise self.error(lines[ip - 1], f"Undefinied property '{name}'.")
+                stack[-1] = BoundMethod(stack[-1], method)
+
+            elif op == CHECK_PROPERTY:
+                instance = stack[-1]
+                name = constants[code[ip]]
+                ip += 1
+                if not isinstance(instance, VMInstance):
+                    raise self.error(lines[ip - 1], "Only instances have properties.")
+                if name not in instance.fields and name not in instance.klass.methods:
+                    raise self.error(lines[ip - 1], f"Undefined property '{name}'.")
+
+            elif op == CHECK_SUPER:
+                name = constants[code[ip]]
+                ip += 1
+                if name not in pop().methods:
+                    raise self.error(lines[ip - 1], f"Undefinied property '{name}'.")
+
+            elif op == CLASS:
+                push(VMClass(constants[code[ip]]))
+                ip += 1
+
+            elif op == INHERIT:
+                superclass = stack[-2]
+                if not isinstance(superclass, VMClass):
+                    raise self.error(lines[ip - 1], "Superclass must be a class.")
+                stack[-1].methods.update(superclass.methods)
+                pop()
+
+            elif op == METHOD:
+                method = pop()
+                stack[-1].methods[constants[code[ip]]] = method
+                ip += 1
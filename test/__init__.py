@@ -0,0 +1,9 @@
+import sys
+
+
+# Tests import the sources as pylox.X while the sources import each other as X,
+# so the classes a Lox instance uses live in a different module object than the
+# ones the tests imported. Patch and inspect through the module an object came
+# from instead.
+def sourceModule(obj):
+    return sys.modules[type(obj).__module__]
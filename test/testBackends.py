@@ -0,0 +1,228 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from pylox.lox import Lox
+
+from . import sourceModule
+
+
+class BackendConformance:
+    # Programs every backend has to run the same way. Each backend gets a
+    # subclass below that only picks the backend.
+    backend = None
+
+    def setUp(self) -> None:
+        self.cacheDir = tempfile.TemporaryDirectory()
+        self.lox = Lox(backend=self.backend)
+        self.lox.pythonBackend.cacheDir = self.cacheDir.name
+
+    def tearDown(self) -> None:
+        self.cacheDir.cleanup()
+
+    def run_lox(self, source, **options):
+        with patch("builtins.print") as mocked:
+            self.lox.run(source, **options)
+        return [str(call.args[0]) for call in mocked.call_args_list]
+
+    def test_arithmetic(self):
+        output = self.run_lox("print (1 + 2) * 2; print 7 / 2;")
+        self.assertEqual(output, ["6", "3.5"])
+
+    def test_large_integers(self):
+        output = self.run_lox(
+            "var big = 9007199254740992; print big + 1; print big + 2; print 6 / 4;"
+        )
+        self.assertEqual(output, ["9007199254740992", "9007199254740994", "1.5"])
+
+    def test_string_building(self):
+        output = self.run_lox(
+            """
+            var s = "";
+            for (var i = 0; i < 1000; i = i + 1) s = s + "ab";
+            var t = "";
+            for (var i = 0; i < 1000; i = i + 1) t = "ab" + t;
+            print s == t;
+            print s + "!" == t;
+            """
+        )
+        self.assertEqual(output, ["true", "false"])
+
+    def test_loop(self):
+        output = self.run_lox(
+            "var sum = 0; for (var i = 0; i < 10; i = i + 1) sum = sum + i; print sum;"
+        )
+        self.assertEqual(output, ["45"])
+
+    def test_closure(self):
+        output = self.run_lox(
+            """
+            fun makeCounter() {
+              var i = 0;
+              fun count() { i = i + 1; return i; }
+              return count;
+            }
+            var c = makeCounter();
+            c();
+            print c();
+            """
+        )
+        self.assertEqual(output, ["2"])
+
+    def test_loop_closures(self):
+        output = self.run_lox(
+            """
+            var first;
+            for (var i = 0; i < 2; i = i + 1) {
+              var j = i;
+              fun get() { return j; }
+              if (first == nil) first = get;
+            }
+            print first();
+            """
+        )
+        self.assertEqual(output, ["0"])
+
+    def test_classes(self):
+        output = self.run_lox(
+            """
+            class A { init(x) { this.x = x; } get() { return this.x; } }
+            class B < A { init(x) { super.init(x * 2); } }
+            print B(2).get();
+            """
+        )
+        self.assertEqual(output, ["4"])
+
+    def test_polymorphic_method_lookups(self):
+        output = self.run_lox(
+            """
+            class A { m() { return "A"; } }
+            class B < A { m() { return "B"; } }
+            class C < B {}
+            fun call(o) { return o.m(); }
+            fun get(o) { var m = o.m; return m(); }
+            for (var i = 0; i < 2; i = i + 1) {
+              print call(A()) + call(B()) + call(C());
+              print get(C()) + get(B()) + get(A());
+            }
+            """
+        )
+        self.assertEqual(output, ["ABB", "BBA"] * 2)
+
+    def test_fields_in_any_order(self):
+        output = self.run_lox(
+            """
+            class P {}
+            fun make(first) {
+              var p = P();
+              if (first) { p.x = 1; p.y = 2; } else { p.y = 3; p.x = 4; }
+              return p;
+            }
+            fun set(p) { p.z = p.x * 10; return p; }
+            fun show(p) { return p.x + p.y + p.z; }
+            for (var i = 0; i < 2; i = i + 1) {
+              print show(set(make(true)));
+              print show(set(make(false)));
+            }
+            """
+        )
+        self.assertEqual(output, ["13", "47"] * 2)
+
+    def test_super_follows_the_superclass(self):
+        output = self.run_lox(
+            """
+            class A { m() { return "A"; } }
+            class B { m() { return "B"; } }
+            fun make(Base) {
+              class C < Base { m() { return "C" + super.m(); } }
+              return C;
+            }
+            print make(A)().m();
+            print make(B)().m();
+            print make(A)().m();
+            """
+        )
+        self.assertEqual(output, ["CA", "CB", "CA"])
+
+    def test_globals_across_lines(self):
+        output = self.run_lox("var a = 1; fun get() { return a; }")
+        output += self.run_lox("a = 2; print get();")
+        output += self.run_lox("var a = 3; print get();")
+        output += self.run_lox("fun get() { return -a; } print get();")
+        self.assertEqual(output, ["2", "3", "-3"])
+
+    def test_optimizer_can_be_turned_off(self):
+        source = """
+            fun square(a) { return a * a; }
+            fun f(x) { var n = 2 * 3; if (false) print "dead"; print square(x) + n; }
+            f(4);
+            print 1 - "a";
+            """
+        lox = sourceModule(self.lox)
+        for optimize, calls in ((True, 1), (False, 0)):
+            with patch.object(lox, "Optimizer", wraps=lox.Optimizer) as optimizer:
+                output = self.run_lox(source, wholeProgram=True, optimize=optimize)
+            self.assertEqual(optimizer.call_count, calls)
+            self.assertEqual(output, ["22", "Operand must be a number \n[line 5]"])
+
+    def test_logical_operands_use_locals(self):
+        output = self.run_lox(
+            """
+            var a = "global";
+            fun f(x) { var a = x; print a or 0; print a and 2; }
+            f(1);
+            """
+        )
+        self.assertEqual(output, ["1", "2"])
+
+    def test_invoke_checks_receiver_first(self):
+        prelude = 'fun f() { print "side effect"; return 1; }\n'
+        output = self.run_lox(prelude + "var x = 1;\nx.m(f());")
+        self.assertEqual(output, ["Only instances have properties. \n[line 3]"])
+
+        output = self.run_lox(prelude + "class A {}\nA().m(f());")
+        self.assertEqual(output, ["Undefined property 'm'. \n[line 3]"])
+
+        output = self.run_lox(
+            prelude + "class A {}\nclass B < A { m() { super.m(f()); } }\nB().m();"
+        )
+        self.assertEqual(output, ["Undefinied property 'm'. \n[line 3]"])
+
+    def test_constant_superclass(self):
+        output = self.run_lox("{\n  var A = 1;\n  class B < A {}\n}")
+        self.assertTrue(self.lox.errorHandler.hadRuntimeError)
+        self.assertEqual(output, ["Superclass must be a class. \n[line 3]"])
+
+    def test_undefined_variable(self):
+        output = self.run_lox("var a = 1;\nprint b;")
+        self.assertTrue(self.lox.errorHandler.hadRuntimeError)
+        self.assertEqual(output, ["Undefined variable b. \n[line 2]"])
+
+    def test_runtime_error(self):
+        output = self.run_lox('print 1 - "a";')
+        self.assertTrue(self.lox.errorHandler.hadRuntimeError)
+        self.assertEqual(output, ["Operand must be a number \n[line 1]"])
+
+
+class TestInterpreterConformance(BackendConformance, unittest.TestCase):
+    backend = "interpreter"
+
+
+class TestTieredConformance(BackendConformance, unittest.TestCase):
+    backend = "tiered"
+
+
+class TestClosureConformance(BackendConformance, unittest.TestCase):
+    backend = "closure"
+
+
+class TestVMConformance(BackendConformance, unittest.TestCase):
+    backend = "vm"
+
+
+class TestPythonConformance(BackendConformance, unittest.TestCase):
+    backend = "python"
+
+
+if __name__ == "__main__":
+    unittest.main()
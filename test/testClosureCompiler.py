@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+
+from pylox.lox import Lox
+
+
+class TestClosureCompiler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lox = Lox(backend="closure")
+
+    def run_lox(self, source):
+        with patch("builtins.print") as mocked:
+            self.lox.run(source)
+        return [str(call.args[0]) for call in mocked.call_args_list]
+
+    def test_tail_calls(self):
+        source = """
+            fun isEven(n) { if (n == 0) return true; return isOdd(n - 1); }
+            fun isOdd(n) { if (n == 0) return false; return isEven(n - 1); }
+            print isEven(5000);
+            """
+        self.assertEqual(self.run_lox(source), ["true"])
+
+
+    def test_invoke_doesnt_bind(self):
+        self.run_lox(
+            """
+            class A { m(x) { return x; } }
+            fun g(x) { return -x; }
+            var a = A();
+            a.field = g;
+            fun tail() { return a.m(4); }
+            """
+        )
+        function = type(self.lox.interpreter.globals.cells["g"].value)
+        with patch.object(
+            function, "bind", autospec=True, side_effect=function.bind
+        ) as bind:
+            output = self.run_lox(
+                "print a.m(1); print a.field(2); var m = a.m; print m(3); print tail();"
+            )
+        # Only the method read without calling it is bound.
+        bind.assert_called_once()
+        self.assertEqual(output, ["1", "-2", "3", "4"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,6 @@
+import gc
+import sys
+import traceback
 import unittest
 from unittest.mock import patch
 
@@ -5,12 +8,21 @@ from pylox.parser import Parser
 from pylox.errorHandler import ErrorHandler
 from pylox.scanner import Scanner
 from pylox.interpreter import Interpreter
+from pylox.lox import Lox
+
+from . import sourceModule
 
 
 class TestInterpreter(unittest.TestCase):
     def setUp(self) -> None:
         self.errorHandler = ErrorHandler
         self.interpreter = Interpreter(self.errorHandler)
+        self.lox = Lox(backend="interpreter")
+
+    def run_lox(self, source, backend=None):
+        with patch("builtins.print") as mocked:
+            self.lox.run(source, backend)
+        return [str(call.args[0]) for call in mocked.call_args_list]
 
     def test_primary(self):
         scanner = Scanner("1", self.errorHandler)
@@ -70,6 +82,385 @@ class TestInterpreter(unittest.TestCase):
         result = self.interpreter.interpret(ast)
         self.assertTrue(result)
 
+    def test_tail_calls(self):
+        lox = Lox(backend="interpreter")
+        with patch("builtins.print") as mocked:
+            lox.run(
+                """
+                fun isEven(n) { if (n == 0) return true; return isOdd(n - 1); }
+                fun isOdd(n) { if (n == 0) return false; return isEven(n - 1); }
+                print isEven(5000);
+                """
+            )
+        output = [str(call.args[0]) for call in mocked.call_args_list]
+        self.assertEqual(output, ["true"])
+
+    def test_call_depth(self):
+        # Python frames per nested Lox call bound how deep Lox code can
+        # recurse, the tail call trampoline mustn't add to them.
+        lox = Lox(backend="interpreter")
+        interpreterModule = sourceModule(lox.interpreter)
+
+        class Depth(interpreterModule.LoxCallable):
+            def __init__(self):
+                self.depths = []
+
+            def arity(self):
+                return 0
+
+            def call(self, interpreter, arguments):
+                self.depths.append(len(traceback.extract_stack()))
+                return 0
+
+        depth = Depth()
+        lox.interpreter.globals.define("depth", depth)
+        lox.run(
+            """
+            fun f(n) { if (n == 0) return depth(); return 1 + f(n - 1); }
+            f(1);
+            f(2);
+            """
+        )
+        self.assertLessEqual(depth.depths[1] - depth.depths[0], 12)
+
+    def test_deep_recursion_overflows_cleanly(self):
+        # Lox calls nest Python frames here, only the vm goes deeper.
+        source = "fun f(n) { if (n == 0) return 0; return 1 + f(n - 1); }"
+        output = self.run_lox(source + "print f(50); print f(1000);")
+        self.assertEqual(output, ["50", "Stack overflow. \n[line 1]"])
+        self.assertTrue(self.lox.errorHandler.hadRuntimeError)
+
+        output = self.run_lox(source + "print f(1000);", backend="vm")
+        self.assertEqual(output, ["1000"])
+
+    def test_frames_are_reused(self):
+        frames = sourceModule(self.lox.interpreter.globals)
+        with patch.object(frames, "freeFrames", []), patch.object(
+            frames, "MAX_FREE_FRAMES", 4
+        ):
+            output = self.run_lox(
+                """
+                fun f(a, b) { return a + b; }
+                print f(1, 2);
+                print f(3, 4);
+                """
+            )
+            self.assertEqual(len(frames.freeFrames), 1)
+            frame = frames.freeFrames[0]
+            self.assertEqual(frame.values, [])
+            output += self.run_lox("print f(5, 6);")
+            self.assertEqual(frames.freeFrames, [frame])
+
+            # Frames released beyond the limit are dropped.
+            output += self.run_lox(
+                "fun sum(n) { if (n == 0) return 0; return n + sum(n - 1); }"
+                "print sum(10);"
+            )
+            self.assertEqual(len(frames.freeFrames), 4)
+        self.assertEqual(output, ["3", "7", "11", "55"])
+
+    def test_return_raises_nothing(self):
+        output = self.run_lox(
+            """
+            fun f(n) {
+              var i = 0;
+              while (true) { { if (i == n) return i; } i = i + 1; }
+            }
+            fun g() { return; }
+            print f(3);
+            print g();
+            """
+        )
+        self.assertEqual(output, ["3", "nil"])
+
+        # Once its nodes have been quickened, a call returns through every
+        # enclosing statement without any exception being raised.
+        exceptions = []
+
+        def trace(frame, event, arg):
+            if event == "exception":
+                exceptions.append(arg[0])
+            return trace
+
+        interpreter = self.lox.interpreter
+        f = interpreter.globals.cells["f"].value
+        g = interpreter.globals.cells["g"].value
+        sys.settrace(trace)
+        try:
+            results = [f.call(interpreter, [5]), g.call(interpreter, [])]
+        finally:
+            sys.settrace(None)
+        self.assertEqual(results, [5, None])
+        self.assertEqual(exceptions, [])
+
+    def test_invoke_doesnt_bind(self):
+        self.run_lox(
+            """
+            class A { m(x) { return x; } }
+            fun g(x) { return -x; }
+            var a = A();
+            a.field = g;
+            fun tail() { return a.m(4); }
+            """
+        )
+        function = type(self.lox.interpreter.globals.cells["g"].value)
+        with patch.object(
+            function, "bind", autospec=True, side_effect=function.bind
+        ) as bind:
+            output = self.run_lox(
+                "print a.m(1); print a.field(2); var m = a.m; print m(3); print tail();"
+            )
+        # Only the method read without calling it is bound.
+        bind.assert_called_once()
+        self.assertEqual(output, ["1", "-2", "3", "4"])
+
+    def test_inherited_methods_are_flattened(self):
+        output = self.run_lox(
+            """
+            class A { a() { return "A.a"; } b() { return "A.b"; } }
+            class B < A { b() { return "B.b"; } c() { return "B.c"; } }
+            class C < B {}
+            var c = C();
+            print c.a();
+            print c.b();
+            print c.c();
+            """
+        )
+        self.assertEqual(output, ["A.a", "B.b", "B.c"])
+
+        cells = self.lox.interpreter.globals.cells
+        a, b, c = cells["A"].value, cells["B"].value, cells["C"].value
+        self.assertEqual(set(c.methods), {"a", "b", "c"})
+        self.assertIs(c.findMethod("a"), a.methods["a"])
+        self.assertIs(c.findMethod("b"), b.methods["b"])
+        self.assertIsNot(c.findMethod("b"), a.methods["b"])
+
+    def test_method_lookups_cache_the_class(self):
+        output = self.run_lox(
+            """
+            class A { m() { return "A"; } }
+            class B < A { m() { return "B"; } }
+            class C < B {}
+            fun call(o) { var r = o.m(); return r; }
+            fun get(o) { var m = o.m; return m(); }
+            print call(A()) + get(A());
+            """
+        )
+        cells = self.lox.interpreter.globals.cells
+        a, b, c = cells["A"].value, cells["B"].value, cells["C"].value
+        invoke = cells["call"].value.declaration.body[0].initializer
+        get = cells["get"].value.declaration.body[0].initializer
+        self.assertEqual(invoke.cachedMethod, (a, a.methods["m"]))
+        self.assertEqual(get.cachedMethod, (a, a.methods["m"]))
+
+        # Each new class at the same call site replaces the cached one.
+        for klass, expected in ((c, "BB"), (b, "BB"), (a, "AA")):
+            output += self.run_lox(f"print call({klass}()) + get({klass}());")
+            self.assertEqual(invoke.cachedMethod, (klass, klass.methods["m"]))
+            self.assertEqual(get.cachedMethod, (klass, klass.methods["m"]))
+        self.assertEqual(output, ["AA", "BB", "BB", "AA"])
+
+    def test_instances_share_shapes(self):
+        output = self.run_lox(
+            """
+            class P {}
+            var a = P(); a.x = 1; a.y = 2;
+            var b = P(); b.x = 3; b.y = 4;
+            var c = P(); c.y = 5; c.x = 6;
+            b.x = 7;
+            print b.x + b.y;
+            print c.x + c.y;
+            """
+        )
+        self.assertEqual(output, ["11", "11"])
+
+        cells = self.lox.interpreter.globals.cells
+        a, b, c = cells["a"].value, cells["b"].value, cells["c"].value
+        # Assigning an existing field keeps the shape.
+        self.assertIs(a.shape, b.shape)
+        self.assertEqual(a.shape.indexes, {"x": 0, "y": 1})
+        self.assertEqual(b.values, [7, 4])
+        # Fields are laid out in the order they were first assigned.
+        self.assertIsNot(c.shape, a.shape)
+        self.assertEqual(c.shape.indexes, {"y": 0, "x": 1})
+        self.assertEqual(c.values, [5, 6])
+
+        instances = sourceModule(a)
+        x = instances.EMPTY_SHAPE.transitions["x"]
+        self.assertIs(x.transitions["y"], a.shape)
+
+    def test_field_accesses_cache_the_shape(self):
+        output = self.run_lox(
+            """
+            class P {}
+            fun make(x, y) { var p = P(); p.x = x; p.y = y; return p; }
+            fun getY(p) { return p.y; }
+            var a = make(1, 2);
+            var b = P(); b.y = 3;
+            print getY(a);
+            """
+        )
+        cells = self.lox.interpreter.globals.cells
+        a, b = cells["a"].value, cells["b"].value
+        get = cells["getY"].value.declaration.body[0].value
+        self.assertEqual(get.cachedField, (a.shape, 1))
+        # The set of y in make moves instances from the x shape to a's.
+        make = cells["make"].value.declaration.body
+        self.assertEqual(make[2].expression.cachedField[2], a.shape)
+
+        # Another shape misses the cache and replaces it.
+        output += self.run_lox("print getY(b); print getY(a);")
+        self.assertEqual(get.cachedField, (a.shape, 1))
+        output += self.run_lox("print getY(b);")
+        self.assertEqual(get.cachedField, (b.shape, 0))
+        self.assertEqual(output, ["2", "3", "2", "3"])
+
+    def test_classes_cache_their_initializer(self):
+        output = self.run_lox(
+            """
+            class A { init(x) { this.x = x; } }
+            class B < A {}
+            class C < A { init() { this.x = "C"; } }
+            print B("B").x;
+            print C().x;
+            class A { init() { this.x = "new A"; } }
+            print A().x;
+            print B("old A").x;
+            """
+        )
+        self.assertEqual(output, ["B", "C", "new A", "old A"])
+
+        cells = self.lox.interpreter.globals.cells
+        a, b, c = cells["A"].value, cells["B"].value, cells["C"].value
+        self.assertIs(b.initializer, b.superclass.methods["init"])
+        self.assertIs(c.initializer, c.methods["init"])
+        self.assertEqual((a.arity(), b.arity(), c.arity()), (0, 1, 0))
+
+        # Constructing runs init without binding it to the new instance.
+        with patch.object(type(a.initializer), "bind") as bind:
+            output = self.run_lox("print A().x; print B(1, 2);")
+        bind.assert_not_called()
+        self.assertEqual(
+            output, ["new A", "Expected 1 arguments but got 2. \n[line 1]"]
+        )
+
+    def test_super_calls_dont_bind(self):
+        self.run_lox(
+            """
+            class A { name() { return this.n; } }
+            class B < A {
+              init() { this.n = "b"; }
+              name() { return "B " + super.name(); }
+              method() { return super.name; }
+            }
+            var b = B();
+            """
+        )
+        b = self.lox.interpreter.globals.cells["B"].value
+        method = b.methods["name"].declaration.body[0].value.right
+        self.assertEqual(type(method).__name__, "SuperInvoke")
+
+        function = type(b.initializer)
+        with patch.object(
+            function, "bind", autospec=True, side_effect=function.bind
+        ) as bind:
+            output = self.run_lox("print b.name(); print b.method()();")
+        # Only super.name without a call binds the method.
+        bind.assert_called_once()
+        self.assertEqual(output, ["B b", "b"])
+
+    def test_super_caches_the_method(self):
+        self.run_lox(
+            """
+            class A { m() { return "A"; } }
+            class B { m() { return "B"; } }
+            fun make(Base) {
+              class C < Base {
+                m() { return "C" + super.m(); }
+                get() { var m = super.m; return m(); }
+              }
+              return C;
+            }
+            """
+        )
+        cells = self.lox.interpreter.globals.cells
+        a, b = cells["A"].value, cells["B"].value
+        methods = cells["make"].value.declaration.body[0].methods
+        invoke = methods[0].body[0].value.right
+        get = methods[1].body[0].initializer
+
+        output = []
+        for base in (a, b, a):
+            output += self.run_lox(
+                f"var c = make({base})(); print c.m(); print c.get();"
+            )
+            self.assertEqual(invoke.cachedMethod, (base, base.methods["m"]))
+            self.assertEqual(get.cachedMethod, (base, base.methods["m"]))
+        self.assertEqual(output, ["CA", "A", "CB", "B", "CA", "A"])
+
+    def test_globals_keep_their_cells(self):
+        output = self.run_lox("var a = 1; fun get() { return a; } print get();")
+        cell = self.lox.interpreter.globals.cells["a"]
+        # Each line is run separately, like the REPL does.
+        output += self.run_lox("a = 2;")
+        output += self.run_lox("print get();")
+        output += self.run_lox("var a = 3;")
+        output += self.run_lox("print get();")
+        self.assertEqual(output, ["1", "2", "3"])
+        self.assertIs(self.lox.interpreter.globals.cells["a"], cell)
+
+        # The read in get found the cell once and kept it.
+        get = self.lox.interpreter.globals.cells["get"].value
+        read = get.declaration.body[0].value
+        self.assertIs(read.resolved[1], cell)
+
+    def test_resolution_goes_away_with_the_ast(self):
+        Expr = sourceModule(self.lox.interpreter).Expr
+
+        def liveNodes():
+            gc.collect()
+            return sum(1 for o in gc.get_objects() if isinstance(o, Expr))
+
+        line = "{ var a = 1; var b = a + 2; print b; } var c = 1; print c - 1;"
+        self.run_lox(line)
+        before = liveNodes()
+        for _ in range(10):
+            self.assertEqual(self.run_lox(line), ["3", "0"])
+        # Nothing keeps the nodes of a line once it has run.
+        self.assertEqual(liveNodes(), before)
+
+    def test_quickened_operations_deoptimize(self):
+        interpreterModule = sourceModule(self.lox.interpreter)
+        generic = interpreterModule.Interpreter
+        output = self.run_lox(
+            "fun add(a, b) { return a + b; } fun negate(a) { return -a; }"
+            "print add(1, 2); print negate(3);"
+        )
+        cells = self.lox.interpreter.globals.cells
+        add = cells["add"].value.declaration.body[0].value
+        negate = cells["negate"].value.declaration.body[0].value
+        self.assertIs(
+            add.quickened, interpreterModule.NUMBER_OPERATIONS[add.operator.type]
+        )
+        self.assertIs(negate.quickened, interpreterModule.numberNegation)
+
+        # Operands of another type fall back to the generic path for good.
+        output += self.run_lox('print add("a", "b"); print add(4, 5);')
+        self.assertIs(add.quickened, generic.binary)
+        output += self.run_lox('print negate("a");')
+        self.assertIs(negate.quickened, generic.unary)
+        output += self.run_lox("print negate(6);")
+        self.assertEqual(
+            output, ["3", "-3", "ab", "9", "Operand must be a number \n[line 1]", "-6"]
+        )
+
+        output = self.run_lox('fun join(a, b) { return a + b; } print join("a", "b");')
+        join = cells["join"].value.declaration.body[0].value
+        self.assertIs(join.quickened, interpreterModule.stringConcatenation)
+        output += self.run_lox('print join(1, 2); print join("c", "d");')
+        self.assertIs(join.quickened, generic.binary)
+        self.assertEqual(output, ["ab", "3", "cd"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,185 @@
+import unittest
+
+from pylox.errorHandler import ErrorHandler
+from pylox.interpreter import Interpreter
+from pylox.optimizer import INLINE_BUDGET
+from pylox.optimizer import Optimizer
+from pylox.parser import Parser
+from pylox.resolver import Resolver
+from pylox.scanner import Scanner
+
+
+class TestOptimizer(unittest.TestCase):
+    def optimize(self, source, wholeProgram=False):
+        errorHandler = ErrorHandler()
+        tokens = Scanner(source, errorHandler).scanTokens()
+        statements = Parser(tokens, errorHandler).parse()
+        resolver = Resolver(Interpreter(errorHandler), errorHandler)
+        resolver.resolve(statements)
+        self.optimizer = Optimizer()
+        if wholeProgram:
+            self.optimizer.findGlobalFunctions(statements, resolver.globalAssignments)
+        return self.optimizer.optimize(statements)
+
+    def assertNode(self, node, kind):
+        self.assertEqual(type(node).__name__, kind)
+
+    def assertLiteral(self, node, value):
+        self.assertNode(node, "Literal")
+        self.assertEqual(node.value, value)
+        self.assertIs(type(node.value), type(value))
+
+    def test_folds_literals(self):
+        statements = self.optimize(
+            """
+            print 1 + 2 * 3;
+            print 7 / 2;
+            print "a" + "b";
+            print -(2);
+            print !nil;
+            print 1 < 2;
+            print nil == false;
+            print true and 3;
+            """
+        )
+        values = [7, 3.5, "ab", -2, True, True, False, 3]
+        for statement, value in zip(statements, values):
+            self.assertLiteral(statement.expression, value)
+
+    def test_leaves_failing_operations(self):
+        statements = self.optimize('print "a" - 1;\nprint 1 / 0;\nprint -"a";')
+        self.assertNode(statements[0].expression, "Binary")
+        self.assertEqual(statements[0].expression.operator.line, 1)
+        self.assertNode(statements[1].expression, "Binary")
+        self.assertNode(statements[2].expression, "Unary")
+
+    def test_propagates_constant_locals(self):
+        function = self.optimize("fun f() { var n = 2 * 3; print n + 1; }")[0]
+        self.assertLiteral(function.body[-1].expression, 7)
+
+    def test_keeps_assigned_locals(self):
+        function = self.optimize("fun f() { var n = 1; n = 2; print n; }")[0]
+        self.assertNode(function.body[-1].expression, "Variable")
+
+    def test_keeps_globals(self):
+        statements = self.optimize("var g = 1; print g;")
+        self.assertNode(statements[1].expression, "Variable")
+
+    def test_drops_statements_after_return(self):
+        function = self.optimize("fun f() { return 1; print 2; var x = 3; }")[0]
+        self.assertEqual(len(function.body), 1)
+        self.assertNode(function.body[0], "Return")
+        self.assertTrue(self.optimizer.stale)
+
+    def test_drops_untaken_branches(self):
+        function = self.optimize(
+            """
+            fun f(x) {
+              if (false) print 1;
+              if (true) print 2; else print 3;
+              while (false) print 4;
+              if (nil) print 5; else print 6;
+              if (x) if (false) print 7;
+            }
+            """
+        )[0]
+        self.assertEqual(len(function.body), 3)
+        self.assertLiteral(function.body[0].expression, 2)
+        self.assertLiteral(function.body[1].expression, 6)
+        self.assertNode(function.body[2].thenBranch, "Block")
+        self.assertEqual(function.body[2].thenBranch.statements, [])
+
+    def test_drops_unused_locals(self):
+        function = self.optimize(
+            'fun f(x) { var a = x; var b = "s"; var c = x; var d = 1; print c + d; }'
+        )[0]
+        self.assertEqual(len(function.body), 2)
+        self.assertEqual(function.body[0].name.lexeme, "c")
+        self.assertNode(function.body[1], "Print")
+
+    def test_keeps_impure_initializers(self):
+        function = self.optimize(
+            'fun f() { var a = g(); var b = undefinedGlobal; var c = 1 - "s"; }'
+        )[0]
+        names = [statement.name.lexeme for statement in function.body]
+        self.assertEqual(names, ["a", "b", "c"])
+
+    def test_keeps_assigned_unread_locals(self):
+        function = self.optimize("fun f() { var a = 1; a = 2; }")[0]
+        self.assertNode(function.body[0], "Var")
+
+    def test_keeps_superclass_constants(self):
+        block = self.optimize("{ var A = 1; class B < A {} }")[0]
+        self.assertEqual([type(s).__name__ for s in block.statements], ["Var", "Class"])
+
+    def test_keeps_globals_unread(self):
+        statements = self.optimize("var unused = 1;")
+        self.assertEqual(len(statements), 1)
+        self.assertFalse(self.optimizer.stale)
+
+    def test_inlines_local_helpers(self):
+        function = self.optimize(
+            """
+            fun f(x) {
+              fun square(a) { return a * a; }
+              print square(x);
+              print square(3);
+            }
+            """
+        )[0]
+        inlined = function.body[1].expression
+        self.assertNode(inlined, "Binary")
+        self.assertEqual(inlined.left.name.lexeme, "x")
+        self.assertEqual(inlined.right.name.lexeme, "x")
+        # Errors in the inlined expression still point into the helper.
+        self.assertEqual(inlined.operator.line, 3)
+        self.assertLiteral(function.body[2].expression, 9)
+        self.assertTrue(self.optimizer.stale)
+
+    def test_respects_inline_budget(self):
+        # a + 1 + 1 ... has two nodes per term on top of the parameter.
+        terms = (INLINE_BUDGET - 1) // 2
+        for count, inlined in ((terms, "Binary"), (terms + 1, "Call")):
+            body = "a" + " + 1" * count
+            function = self.optimize(
+                f"fun f(x) {{ fun g(a) {{ return {body}; }} print g(x); }}"
+            )[0]
+            self.assertNode(function.body[1].expression, inlined)
+
+    def test_keeps_calls_that_cant_be_inlined(self):
+        function = self.optimize(
+            """
+            fun f(x) {
+              fun square(a) { return a * a; }
+              fun loop(a) { return loop(a); }
+              fun swap(a) { return a; }
+              swap = square;
+              print square(h());
+              print square(1, 2);
+              print loop(x);
+              print swap(x);
+            }
+            """
+        )[0]
+        for statement in function.body[4:]:
+            self.assertNode(statement.expression, "Call")
+
+    def test_inlines_globals_only_in_whole_programs(self):
+        source = """
+            print square(2);
+            fun square(a) { return a * a; }
+            fun twice(a) { return a + a; }
+            fun f(x) { print square(x); print twice(x); }
+            twice = nil;
+            """
+        statements = self.optimize(source)
+        self.assertNode(statements[3].body[0].expression, "Call")
+
+        statements = self.optimize(source, wholeProgram=True)
+        self.assertNode(statements[0].expression, "Call")
+        self.assertNode(statements[3].body[0].expression, "Binary")
+        self.assertNode(statements[3].body[1].expression, "Call")
+
+
+if __name__ == "__main__":
+    unittest.main()
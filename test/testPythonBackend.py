@@ -0,0 +1,94 @@
+import gc
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from pylox.lox import Lox
+
+
+class TestPythonBackend(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cacheDir = tempfile.TemporaryDirectory()
+        self.lox = Lox(backend="python")
+        self.lox.pythonBackend.cacheDir = self.cacheDir.name
+
+    def tearDown(self) -> None:
+        self.cacheDir.cleanup()
+
+    def run_lox(self, source):
+        with patch("builtins.print") as mocked:
+            self.lox.run(source)
+        return [str(call.args[0]) for call in mocked.call_args_list]
+
+    def test_cache(self):
+        source = "print 1 + 2;"
+        self.assertEqual(self.run_lox(source), ["3"])
+        self.assertEqual(len(os.listdir(self.cacheDir.name)), 1)
+        self.assertIsNotNone(self.lox.pythonBackend.load(source))
+        self.assertEqual(self.run_lox(source), ["3"])
+
+
+    def test_cache_keeps_unoptimized_code_apart(self):
+        source = "print 1 + 2;"
+        self.assertEqual(self.run_lox(source), ["3"])
+        self.assertIsNone(self.lox.pythonBackend.load(source, optimize=False))
+        with patch("builtins.print"):
+            self.lox.run(source, optimize=False)
+        self.assertEqual(len(os.listdir(self.cacheDir.name)), 2)
+
+    def test_line_maps_go_with_their_code(self):
+        backend = self.lox.pythonBackend
+        output = self.run_lox("fun f(x) {\n  return -x;\n}")
+        for i in range(10):
+            output += self.run_lox(f"print {i};")
+        gc.collect()
+        # Only the line that defined f still has code that can run.
+        self.assertEqual(len(backend.lineMaps), 1)
+        output += self.run_lox('f("a");')
+        self.assertEqual(output[-1], "Operand must be a number \n[line 2]")
+
+        output += self.run_lox("fun f() {}")
+        gc.collect()
+        self.assertEqual(len(backend.lineMaps), 1)
+
+    def test_long_expressions(self):
+        terms = " + ".join(["a"] * 300)
+        source = f"""
+            var a = 1;
+            var b;
+            fun f(a) {{ var c = 0; print (c = {terms}) and (b = {terms}); }}
+            f(2);
+            print b;
+            """
+        self.assertEqual(self.run_lox(source), ["600", "600"])
+        # It was compiled to Python, not handed to another backend.
+        self.assertEqual(len(os.listdir(self.cacheDir.name)), 1)
+
+    def test_nested_loops(self):
+        loops = "".join(
+            f"for (var i{i} = 0; i{i} < 2; i{i} = i{i} + 1) " for i in range(30)
+        )
+        source = f"""
+            var total = 0;
+            fun f() {{
+              var n = 0;
+              {loops} {{ n = n + 1; total = total + 1; if (n == 5) return n; }}
+              return -1;
+            }}
+            print f();
+            print total;
+            {"for (var i = 0; i < 1; i = i + 1) " * 30} total = total + 1;
+            print total;
+            """
+        self.assertEqual(self.run_lox(source), ["5", "5", "6"])
+        self.assertEqual(len(os.listdir(self.cacheDir.name)), 1)
+
+    def test_falls_back_when_python_cant_compile(self):
+        source = "var n = 0;" + "if (n == 0) {" * 120 + "n = 1;" + "}" * 120
+        self.assertEqual(self.run_lox(source + "print n;"), ["1"])
+        self.assertEqual(os.listdir(self.cacheDir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import patch
+
+from pylox.errorHandler import ErrorHandler
+from pylox.interpreter import Interpreter
+from pylox.parser import Parser
+from pylox.resolver import Resolver
+from pylox.scanner import Scanner
+
+from . import sourceModule
+
+
+class TestResolver(unittest.TestCase):
+    def setUp(self) -> None:
+        self.errorHandler = ErrorHandler()
+        self.interpreter = Interpreter(self.errorHandler)
+
+    def resolve(self, source):
+        tokens = Scanner(source, self.errorHandler).scanTokens()
+        statements = Parser(tokens, self.errorHandler).parse()
+        Resolver(self.interpreter, self.errorHandler).resolve(statements)
+        return statements
+
+    def run_lox(self, statements):
+        with patch("builtins.print") as mocked:
+            self.interpreter.interpret(statements)
+        return [str(call.args[0]) for call in mocked.call_args_list]
+
+    def test_locals_resolve_to_slots(self):
+        statements = self.resolve(
+            """
+            fun f(a, b) {
+              var c = a;
+              { var d = c; print d + b; }
+            }
+            f(1, 2);
+            """
+        )
+        body = statements[0].body
+        # Parameters take the first slots of the frame, locals follow them.
+        self.assertEqual(body[0].initializer.resolved, (0, 0, False))
+        block = body[1].statements
+        self.assertEqual(block[0].initializer.resolved, (1, 2, False))
+        self.assertEqual(block[1].expression.left.resolved, (0, 0, False))
+        self.assertEqual(block[1].expression.right.resolved, (1, 1, False))
+        self.assertIs(block[1].expression.right.declaration, statements[0].params[1])
+        self.assertEqual(self.run_lox(statements), ["3"])
+
+    def test_only_assigned_captures_are_boxed(self):
+        statements = self.resolve(
+            """
+            fun f() {
+              var a = 1;
+              var b = 2;
+              fun g() { return a + b; }
+              a = 3;
+              return g;
+            }
+            fun counter(n) { fun count() { n = n + 1; return n; } return count; }
+            var g = f();
+            var count = counter(0);
+            print g();
+            count();
+            print count();
+            """
+        )
+        body = statements[0].body
+        self.assertTrue(body[0].name.boxed)
+        self.assertFalse(body[1].name.boxed)
+        self.assertEqual(body[2].upvalues, ((0, 0), (0, 1)))
+        self.assertEqual(body[2].body[0].value.left.resolved, (-1, 0, True))
+        self.assertEqual(body[2].body[0].value.right.resolved, (-1, 1, False))
+        # Captured parameters are boxed when the call starts.
+        self.assertEqual(statements[1].cells, (0,))
+        self.assertEqual(self.run_lox(statements), ["5", "2"])
+
+        # b is copied into the closure, a is shared with f through a Cell.
+        a, b = self.interpreter.globals.cells["g"].value.upvalues
+        self.assertEqual(type(a).__name__, "Cell")
+        self.assertEqual(a.value, 3)
+        self.assertEqual(b, 2)
+
+    def test_empty_blocks_use_the_enclosing_environment(self):
+        statements = self.resolve(
+            """
+            fun f(a) {
+              { print a; }
+              while (a > 0) { a = a - 1; }
+              { var b = a; { print b; } }
+            }
+            f(2);
+            """
+        )
+        body = statements[0].body
+        self.assertTrue(body[0].isEmpty)
+        self.assertTrue(body[1].body.isEmpty)
+        self.assertFalse(body[2].isEmpty)
+        self.assertTrue(body[2].statements[1].isEmpty)
+        # Empty blocks don't count towards distances.
+        self.assertEqual(body[0].statements[0].expression.resolved, (0, 0, False))
+        self.assertEqual(body[1].body.statements[0].expression.resolved, (0, 0, False))
+        inner = body[2].statements[1].statements[0]
+        self.assertEqual(inner.expression.resolved, (0, 0, False))
+
+        interpreterModule = sourceModule(self.interpreter)
+        with patch.object(
+            interpreterModule, "Environment", wraps=interpreterModule.Environment
+        ) as environment:
+            self.assertEqual(self.run_lox(statements), ["2", "0"])
+        environment.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 from pylox.scanner import Scanner
 from pylox.token import TokenType
 from pylox.errorHandler import ErrorHandler
+import sys
 import unittest
 from unittest.mock import MagicMock, patch
 
@@ -119,6 +120,18 @@ class TestScanner(unittest.TestCase):
         self.assertEqual(tokens[0].type, TokenType.VAR)
         self.assertEqual(tokens[1].type, TokenType.FUN)
 
+    def test_interning(self):
+        source = 'counter = counter + "one two"; print "one two";'
+        tokens = Scanner(source, self.errorHandler).scanTokens()
+        self.assertIs(tokens[0].lexeme, tokens[2].lexeme)
+        self.assertIs(tokens[4].literal, tokens[7].literal)
+
+        # Every scan shares the same strings, whatever source they came from.
+        other = Scanner('var counter = "one two";', self.errorHandler).scanTokens()
+        self.assertIs(other[1].lexeme, tokens[0].lexeme)
+        self.assertIs(other[3].literal, tokens[4].literal)
+        self.assertIs(sys.intern("".join(["count", "er"])), tokens[0].lexeme)
+
     def test_multilineWithComments(self):
         expected = [
             TokenType.VAR,
@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+
+from pylox.lox import Lox
+
+from . import sourceModule
+
+
+class TestTiered(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lox = Lox(backend="tiered")
+        # The module the interpreter was loaded from, which holds the
+        # tier-up thresholds.
+        self.tiers = sourceModule(self.lox.interpreter)
+
+    def run_lox(self, source):
+        with patch("builtins.print") as mocked:
+            self.lox.run(source)
+        return [str(call.args[0]) for call in mocked.call_args_list]
+
+    def declaration(self, name):
+        return self.lox.interpreter.globals.cells[name].value.declaration
+
+    def test_function_tiers_up_after_enough_calls(self):
+        with patch.object(self.tiers, "TIER_UP_CALLS", 3):
+            output = self.run_lox("fun f(n) { return n + 1; } print f(1); print f(2);")
+            self.assertIsNone(getattr(self.declaration("f"), "compiled", None))
+            output += self.run_lox("print f(3); print f(4);")
+        self.assertIsNotNone(self.declaration("f").compiled)
+        self.assertEqual(output, ["2", "3", "4", "5"])
+
+    def test_loop_hands_over_mid_iteration(self):
+        interpreter = self.lox.interpreter
+        with patch.object(self.tiers, "TIER_UP_ITERATIONS", 3), patch.object(
+            interpreter, "tierUp", wraps=interpreter.tierUp
+        ) as tierUp:
+            output = self.run_lox("var i = 0; while (i < 6) { print i; i = i + 1; }")
+        self.assertEqual(output, ["0", "1", "2", "3", "4", "5"])
+        tierUp.assert_called_once()
+        loop = tierUp.call_args.args[0]
+        self.assertIsNotNone(loop.compiled)
+        self.assertEqual(loop.iterations, 3)
+
+    def test_redefinitions_after_tier_up(self):
+        with patch.object(self.tiers, "TIER_UP_CALLS", 2):
+            output = self.run_lox(
+                """
+                var k = 1;
+                fun g() { return 10; }
+                class A { m() { return 100; } }
+                fun f(x) { if (x) return h(); return k + g() + A().m(); }
+                print f(false);
+                print f(false);
+                print f(true);
+                """
+            )
+            self.assertIsNotNone(self.declaration("f").compiled)
+            output += self.run_lox(
+                """
+                var k = 2;
+                fun g() { return 20; }
+                class A { m() { return 200; } }
+                fun h() { return "h"; }
+                print f(false);
+                print f(true);
+                """
+            )
+        self.assertEqual(
+            output, ["111", "111", "Undefined variable h. \n[line 5]", "222", "h"]
+        )
+
+    def test_deoptimize_pins_node(self):
+        interpreter = self.lox.interpreter
+        with patch.object(self.tiers, "TIER_UP_CALLS", 2), patch.object(
+            interpreter, "tierUp", wraps=interpreter.tierUp
+        ) as tierUp:
+            self.run_lox("fun f(n) { return n * 2; }")
+            interpreter.deoptimize(self.declaration("f"))
+            output = self.run_lox("for (var i = 0; i < 5; i = i + 1) print f(i);")
+        self.assertEqual(output, ["0", "2", "4", "6", "8"])
+        self.assertIsNone(self.declaration("f").compiled)
+        for call in tierUp.call_args_list:
+            self.assertIsNot(call.args[0], self.declaration("f"))
+
+
+if __name__ == "__main__":
+    unittest.main()
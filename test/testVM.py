@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+
+from pylox.lox import Lox
+
+from . import sourceModule
+
+
+class TestVM(unittest.TestCase):
+    def setUp(self) -> None:
+        self.lox = Lox(backend="vm")
+
+    def run_lox(self, source):
+        with patch("builtins.print") as mocked:
+            self.lox.run(source)
+        return [str(call.args[0]) for call in mocked.call_args_list]
+
+    def test_deep_recursion(self):
+        output = self.run_lox(
+            """
+            fun count(n) { if (n == 0) return 0; return 1 + count(n - 1); }
+            print count(5000);
+            """
+        )
+        self.assertEqual(output, ["5000"])
+
+    def test_invoke_doesnt_bind(self):
+        vm = sourceModule(self.lox.vm)
+        with patch.object(
+            vm.BoundMethod,
+            "__init__",
+            autospec=True,
+            side_effect=vm.BoundMethod.__init__,
+        ) as bind:
+            output = self.run_lox(
+                """
+            class A { m(x) { return x; } }
+            fun g(x) { return -x; }
+            var a = A();
+            a.field = g;
+            fun tail() { return a.m(4); }
+            print a.m(1); print a.field(2); var m = a.m; print m(3); print tail();
+                """
+            )
+        # Only the method read without calling it is bound.
+        bind.assert_called_once()
+        self.assertEqual(output, ["1", "-2", "3", "4"])
+
+    def test_stack_overflow(self):
+        self.lox = Lox(backend="vm", framesMax=100)
+        output = self.run_lox("fun f(n) { return 1 + f(n + 1); }\nprint f(0);")
+        self.assertTrue(self.lox.errorHandler.hadRuntimeError)
+        self.assertEqual(output, ["Stack overflow. \n[line 1]"])
+
+    def test_jump_limits(self):
+        body = "print c;" * 30000
+        output = self.run_lox("var c = false; if (c) {" + body + "}")
+        self.assertTrue(self.lox.errorHandler.hadError)
+        self.assertEqual(output, ["[1] Error : Too much code to jump over."])
+
+        self.lox = Lox(backend="vm")
+        output = self.run_lox("var c = false; while (c) {" + body + "}")
+        self.assertTrue(self.lox.errorHandler.hadError)
+        self.assertEqual(output[0], "[1] Error : Loop body too large.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,6 +13,8 @@ exprAST = (
         "Unary": ("operator", "right"),
         "Variable": ("name",),
         "Assignment": ("name", "value"),
+        "Invoke": ("obj", "name", "paren", "arguments"),
+        "SuperInvoke": ("keyword", "method", "paren", "arguments"),
     },
 )
 